@@ -0,0 +1,238 @@
+# bench_dimensions.py
+# Recall@k vs latency and storage of two-stage search at different index dimensions.
+#
+# Chunks the given PDFs the way create_vectorsV4 does, embeds them and a set of queries at the
+# full EMBEDDING_DIM, and then for each candidate index dimension measures how many of the exact
+# full-dimension top-k results are found by (a) searching the truncated, renormalized vectors
+# alone and (b) over-fetching from them and rescoring with the full vectors, i.e. what
+# INDEX_DIM / RESCORE_OVERFETCH do in create_vectorsV4. The default queries are the interview
+# questions in DS_interview.pdf.
+#
+# Embeddings come from Gemini through the shared embedding cache (GOOGLE_API_KEY needed once per
+# text). --fake uses bench_ingest's hash-based vectors instead; those have no semantic structure,
+# so their recall numbers only show that the script runs.
+#
+# Search here is exact (brute force) at each dimension, so recall reflects the truncation only,
+# not Pinecone's ANN approximation, and latency is local compute, not the Pinecone round trip.
+#
+#   python bench_dimensions.py --output dims.json
+#   python bench_dimensions.py --dims 128 256 512 --overfetch 2 4 8 --distractors 100000
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import create_vectorsV4
+from bench_ingest import FakeBackend, FakeEmbeddingClient, git_revision
+from chunker import Chunker, TARGET_CHARS, MAX_CHARS, OVERLAP_CHARS
+from embedding_cache import EmbeddingCache
+from ingest_pipeline import percentile
+
+DEFAULT_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'documents', 'DS_interview.pdf')
+DEFAULT_DIMS = [64, 128, 256, 512, 768, 1024]
+DEFAULT_OVERFETCH = [2, 4, 8]
+MIN_QUESTION_CHARS = 20
+
+
+def extract_questions(pdf_paths):
+    """
+    Returns the distinct lines of the PDFs that read as questions (end with '?').
+    """
+    questions = []
+    for pdf_path in pdf_paths:
+        for page_text in create_vectorsV4.iter_pdf_pages(pdf_path):
+            for line in page_text.splitlines():
+                line = re.sub(r'^[\W_]+', '', line.replace('\x00', '')).strip()
+                if line.endswith('?') and len(line) >= MIN_QUESTION_CHARS:
+                    questions.append(line)
+    return list(dict.fromkeys(questions))
+
+
+def chunk_pdfs(pdf_paths, chunker_options):
+    texts = []
+    for pdf_path in pdf_paths:
+        chunker = Chunker(**chunker_options)
+        texts.extend(chunk['text'] for chunk in chunker.chunk_pages(enumerate(create_vectorsV4.iter_pdf_pages(pdf_path))))
+    return texts
+
+
+def embed_matrix(texts):
+    """
+    Embeds texts at EMBEDDING_DIM; returns (unit-length float32 matrix, kept texts).
+    """
+    vectors = create_vectorsV4.embed_texts(texts)
+    kept = [(text, vector) for text, vector in zip(texts, vectors) if vector is not None]
+    if not kept:
+        return np.zeros((0, create_vectorsV4.EMBEDDING_DIM), dtype=np.float32), []
+    return normalize(np.asarray([vector for _, vector in kept], dtype=np.float32)), [text for text, _ in kept]
+
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def top_indices(scores, k):
+    """
+    Indices of the k highest scores, best first.
+    """
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def evaluate_dimension(corpus, queries, truth, dim, top_k, overfetch_factors, repeat):
+    """
+    Recall@top_k and per-query latency of truncated-only and two-stage search at `dim`.
+    """
+    reduced_corpus = normalize(corpus[:, :dim])
+    reduced_queries = normalize(queries[:, :dim])
+    full = dim >= corpus.shape[1]
+
+    def recall(found):
+        return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+    def timed(search):
+        samples, found = [], []
+        for _ in range(repeat):
+            found = []
+            for q in range(len(queries)):
+                start = time.perf_counter()
+                found.append(search(q))
+                samples.append((time.perf_counter() - start) * 1000)
+        return found, {f'p{pct}': percentile(samples, pct) for pct in (50, 95)}
+
+    found, latency = timed(lambda q: top_indices(reduced_corpus @ reduced_queries[q], top_k))
+    result = {
+        'dim': dim,
+        'truncated': {'recall': recall(found), 'latency_ms': latency},
+        'rescored': [],
+        'bytes_per_vector': {
+            'index': dim * 4,
+            'local_full': 0 if full else corpus.shape[1] * 4,
+        },
+    }
+    if full:
+        return result  # Nothing to rescore at full dimension
+
+    for factor in overfetch_factors:
+        def two_stage(q, factor=factor):
+            candidates = top_indices(reduced_corpus @ reduced_queries[q], top_k * factor)
+            return candidates[top_indices(corpus[candidates] @ queries[q], top_k)]
+
+        found, latency = timed(two_stage)
+        result['rescored'].append({
+            'overfetch': factor,
+            'candidates': min(top_k * factor, len(corpus)),
+            'recall': recall(found),
+            'latency_ms': latency,
+        })
+    return result
+
+
+def run_benchmark(pdf_paths, queries, dims, top_k, overfetch_factors, chunker_options, distractors=0,
+                  repeat=3, seed=0):
+    texts = chunk_pdfs(pdf_paths, chunker_options)
+    corpus, texts = embed_matrix(texts)
+    query_matrix, queries = embed_matrix(queries)
+    if not len(corpus) or not len(query_matrix):
+        raise RuntimeError("Nothing could be embedded; is GOOGLE_API_KEY set (or pass --fake)?")
+    chunks = len(corpus)
+    if distractors:
+        # Random unit vectors are far from every real text, so they leave the exact top-k alone
+        # but make the corpus large enough for the search latency to be measurable
+        rng = np.random.default_rng(seed)
+        corpus = np.vstack([corpus, normalize(rng.standard_normal((distractors, corpus.shape[1]),
+                                                                   dtype=np.float32))])
+    top_k = min(top_k, chunks)
+    truth = [top_indices(corpus @ query, top_k) for query in query_matrix]
+    if top_k * max(overfetch_factors, default=1) >= len(corpus):
+        print(f"Warning: top_k x over-fetch reaches the whole corpus ({len(corpus)} vectors), so rescored "
+              f"recall is trivially 1; use smaller chunks, --pdf or --distractors.")
+
+    results = [evaluate_dimension(corpus, query_matrix, truth, dim, top_k, overfetch_factors, repeat)
+               for dim in dims]
+    for result in results:
+        result['storage_bytes'] = {key: value * len(corpus) for key, value in result['bytes_per_vector'].items()}
+    return {
+        'chunks': chunks,
+        'distractors': distractors,
+        'queries': len(query_matrix),
+        'top_k': top_k,
+        'embedding_dim': corpus.shape[1],
+        'dimensions': results,
+    }
+
+
+def print_table(result):
+    print(f"{result['chunks']} chunks + {result['distractors']} distractors, {result['queries']} queries, "
+          f"recall@{result['top_k']} against exact {result['embedding_dim']}-dim search")
+    print(f"{'dim':>5} {'mode':>12} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'index B/vec':>12} {'local B/vec':>12}")
+    for dim in result['dimensions']:
+        sizes = dim['bytes_per_vector']
+        rows = [('truncated', dim['truncated'], 0)]
+        rows += [(f"rescore x{r['overfetch']}", r, sizes['local_full']) for r in dim['rescored']]
+        for mode, row, local in rows:
+            print(f"{dim['dim']:>5} {mode:>12} {row['recall']:>7.3f} {row['latency_ms']['p50']:>8.3f} "
+                  f"{row['latency_ms']['p95']:>8.3f} {sizes['index']:>12} {local:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k vs latency and storage per index dimension.")
+    parser.add_argument("--pdf", action="append", default=[],
+                        help=f"PDF to index (repeatable, default {os.path.relpath(DEFAULT_PDF)}).")
+    parser.add_argument("--queries", help="Text file with one query per line (default: questions in the PDFs).")
+    parser.add_argument("--dims", type=int, nargs='+', default=DEFAULT_DIMS)
+    parser.add_argument("--overfetch", type=int, nargs='+', default=DEFAULT_OVERFETCH,
+                        help="Candidate multiples of top-k to rescore.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--target-chars", type=int, default=TARGET_CHARS, help="Preferred chunk length.")
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS, help="Hard chunk length limit.")
+    parser.add_argument("--overlap-chars", type=int, default=OVERLAP_CHARS)
+    parser.add_argument("--distractors", type=int, default=0,
+                        help="Random vectors added to the corpus to measure latency at a larger scale.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the queries.")
+    parser.add_argument("--fake", action="store_true",
+                        help="Use hash-based fake embeddings (no API key; recall is meaningless).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the result JSON here.")
+    args = parser.parse_args()
+
+    pdf_paths = args.pdf or [DEFAULT_PDF]
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = extract_questions(pdf_paths)
+
+    fake_dir = None
+    if args.fake:
+        # Fake vectors must not end up in the shared embedding cache
+        fake_dir = tempfile.mkdtemp(prefix='bench_dims_')
+        create_vectorsV4.use_backends(embedding_client=FakeEmbeddingClient(FakeBackend('embed')),
+                                      embedding_cache=EmbeddingCache(os.path.join(fake_dir, 'embeddings.sqlite3')))
+    try:
+        chunker_options = {'target_chars': args.target_chars, 'max_chars': args.max_chars,
+                           'overlap_chars': args.overlap_chars}
+        result = run_benchmark(pdf_paths, queries, sorted(set(args.dims)), args.top_k, args.overfetch,
+                               chunker_options, args.distractors, args.repeat, args.seed)
+    finally:
+        if fake_dir:
+            shutil.rmtree(fake_dir, ignore_errors=True)
+
+    print_table(result)
+    report = {
+        'benchmark': 'dimensions',
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'config': vars(args),
+        'result': result,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
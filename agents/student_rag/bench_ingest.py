@@ -0,0 +1,346 @@
+# bench_ingest.py
+# Offline benchmark of the create_vectorsV4 ingestion path.
+#
+# The Gemini client and the Pinecone index are replaced by local stand-ins with configurable
+# latency, error rate and rate limit, so the whole extraction -> chunking -> dedup ->
+# embedding -> upsert pipeline can be measured without API keys. Results are written as
+# JSON; pass an earlier result file as --baseline to flag regressions between versions.
+#
+#   python bench_ingest.py --synthetic 20 --pages 30 --pdf documents/DS_interview.pdf --output bench.json
+#   python bench_ingest.py --synthetic 20 --pages 30 --baseline bench.json
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import fitz  # PyMuPDF
+
+import create_vectorsV4
+from chunk_store import ChunkStore
+from embedding_cache import EmbeddingCache
+from ingest_manifest import IngestManifest
+from ingest_pipeline import percentile
+
+
+class FakeRateLimitError(Exception):
+    pass
+
+
+class FakeBackend:
+    """
+    Simulates a remote API: each call sleeps for `latency_ms` (+/- `jitter_ms`), fails with
+    probability `error_rate`, and is rejected once more than `rate_limit_per_min` calls
+    were made in the last minute (0 disables the limit). Call latencies are recorded.
+    """
+
+    def __init__(self, name, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, rate_limit_per_min=0, seed=0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_per_min = rate_limit_per_min
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.latencies = []
+        self._rng = random.Random(seed)
+        self._recent_calls = []
+        self._lock = threading.Lock()
+
+    def call(self):
+        start = time.perf_counter()
+        with self._lock:
+            self.calls += 1
+            if self.rate_limit_per_min:
+                self._recent_calls = [t for t in self._recent_calls if start - t < 60]
+                if len(self._recent_calls) >= self.rate_limit_per_min:
+                    self.rate_limited += 1
+                    raise FakeRateLimitError(f"429 {self.name}: rate limit exceeded")
+                self._recent_calls.append(start)
+            delay = max(self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms), 0.0) / 1000
+            fail = self._rng.random() < self.error_rate
+        time.sleep(delay)
+        with self._lock:
+            self.latencies.append(time.perf_counter() - start)
+            if fail:
+                self.errors += 1
+        if fail:
+            raise RuntimeError(f"{self.name}: simulated server error")
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rate_limited': self.rate_limited,
+            'latency_ms': {f'p{pct}': percentile(self.latencies, pct) * 1000 for pct in (50, 95, 99)},
+        }
+
+
+def fake_vector(text, dimensionality):
+    """
+    Deterministic pseudo-random unit vector for a text, so equal texts embed equally.
+    """
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    values = [rng.gauss(0, 1) for _ in range(dimensionality)]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+class FakeEmbeddingClient:
+    """
+    Stands in for genai.Client: client.models.embed_content(model=..., contents=..., config=...).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.models = self
+
+    def embed_content(self, model, contents, config):
+        self.backend.call()
+        if isinstance(contents, str):
+            contents = [contents]
+        dimensionality = config['output_dimensionality']
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=fake_vector(text, dimensionality))
+                                           for text in contents])
+
+
+class FakeVectorIndex:
+    """
+    Stands in for a Pinecone Index with upsert, delete and a brute-force query.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.vectors = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors):
+        self.backend.call()
+        with self._lock:
+            for vector_id, values, metadata in vectors:
+                self.vectors[vector_id] = (values, metadata)
+
+    def delete(self, ids):
+        self.backend.call()
+        with self._lock:
+            for vector_id in ids:
+                self.vectors.pop(vector_id, None)
+
+    def query(self, vector, top_k=5, include_metadata=False):
+        self.backend.call()
+        with self._lock:
+            scored = [(sum(a * b for a, b in zip(vector, values)), vector_id, metadata)
+                      for vector_id, (values, metadata) in self.vectors.items()]
+        scored.sort(reverse=True)
+        return {'matches': [{'id': vector_id, 'score': score, 'metadata': metadata if include_metadata else {}}
+                            for score, vector_id, metadata in scored[:top_k]]}
+
+
+def make_synthetic_pdfs(directory, count, pages, seed=0):
+    """
+    Writes `count` PDFs of `pages` pages of random prose-like text and returns their paths.
+    """
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10)))
+                  for _ in range(5000)]
+    paths = []
+    for doc_no in range(count):
+        path = os.path.join(directory, f'synthetic_{doc_no:03d}.pdf')
+        with fitz.open() as doc:
+            for _ in range(pages):
+                paragraphs = []
+                for _ in range(rng.randint(3, 6)):
+                    sentences = [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(6, 20))).capitalize() + '.'
+                                 for _ in range(rng.randint(2, 5))]
+                    paragraphs.append(' '.join(sentences))
+                page = doc.new_page()
+                page.insert_textbox(fitz.Rect(40, 40, 560, 800), '\n\n'.join(paragraphs), fontsize=8)
+            doc.save(path)
+        paths.append(path)
+    return paths
+
+
+def timed_call(fn, latencies):
+    """
+    Wraps fn so that the duration of every call is appended to `latencies` (seconds).
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and of its finished children (extraction workers).
+    """
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB elsewhere
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return {'self': own, 'children': children}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(pdf_paths, workers=1, embed_backend=None, index_backend=None, queue_size=None,
+                  chunker_options=None):
+    """
+    Ingests `pdf_paths` through create_vectorsV4 with fake backends and a fresh, empty
+    embedding cache, chunk store and manifest. Returns a JSON-serializable result dict.
+    """
+    embed_backend = embed_backend or FakeBackend('embed')
+    index_backend = index_backend or FakeBackend('index')
+    work_dir = tempfile.mkdtemp(prefix='bench_ingest_')
+    try:
+        documents_dir = os.path.join(work_dir, 'documents')
+        os.makedirs(documents_dir)
+        local_paths = []
+        for pdf_path in pdf_paths:
+            local_path = os.path.join(documents_dir, os.path.basename(pdf_path))
+            shutil.copyfile(pdf_path, local_path)
+            local_paths.append(local_path)
+
+        index = FakeVectorIndex(index_backend)
+        chunk_store = ChunkStore(os.path.join(work_dir, 'chunks.sqlite3'))
+        create_vectorsV4.use_backends(embedding_client=FakeEmbeddingClient(embed_backend), index=index,
+                                      embedding_cache=EmbeddingCache(os.path.join(work_dir, 'embeddings.sqlite3')),
+                                      chunk_store=chunk_store)
+        manifest = IngestManifest(os.path.join(work_dir, 'manifest.json'))
+
+        # The embed and upsert stages work a batch at a time, so the pipeline's time between
+        # outputs says little about them; time each batch call instead
+        batch_latencies = {'embed': [], 'upsert': []}
+        embed_texts = create_vectorsV4.embed_texts
+        upsert_batch = create_vectorsV4._upsert_batch_with_retry
+        create_vectorsV4.embed_texts = timed_call(embed_texts, batch_latencies['embed'])
+        create_vectorsV4._upsert_batch_with_retry = timed_call(upsert_batch, batch_latencies['upsert'])
+        try:
+            start = time.perf_counter()
+            changed, _ = manifest.plan(documents_dir, local_paths)
+            upsert_stats, stage_stats = create_vectorsV4.ingest_changed_files(
+                changed, manifest, workers=workers, queue_size=queue_size or create_vectorsV4.INGEST_QUEUE_SIZE,
+                chunker_options=chunker_options)
+            seconds = time.perf_counter() - start
+        finally:
+            create_vectorsV4.embed_texts = embed_texts
+            create_vectorsV4._upsert_batch_with_retry = upsert_batch
+
+        for stage in stage_stats:
+            latencies = batch_latencies.get(stage['stage'])
+            if latencies is not None:
+                stage['latency_unit'] = 'batch'
+                stage['batches'] = len(latencies)
+                stage['latency_ms'] = {f'p{pct}': percentile(latencies, pct) * 1000 for pct in (50, 95, 99)}
+        # Both the source and the chunk stage emit one end-of-document marker per file
+        chunks = next((s['items_out'] for s in stage_stats if s['stage'] == 'chunk'), 0) - len(changed)
+        pages = next((s['items_out'] for s in stage_stats if s['stage'] == 'source'), 0) - len(changed)
+        return {
+            'files': len(local_paths),
+            'pages': pages,
+            'chunks': chunks,
+            'vectors_upserted': upsert_stats['upserted'],
+            'vectors_failed': upsert_stats['failed'],
+            'vectors_in_index': len(index.vectors),
+            'index_metadata_bytes': sum(len(json.dumps(metadata)) for _, metadata in index.vectors.values()),
+            'chunk_store': chunk_store.stats(),
+            'seconds': seconds,
+            'chunks_per_sec': chunks / seconds if seconds else 0.0,
+            'stages': stage_stats,
+            'backends': {'embed': embed_backend.summary(), 'index': index_backend.summary()},
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare_to_baseline(result, baseline, tolerance):
+    """
+    Prints throughput and latency changes against an earlier result; returns True on a regression.
+    """
+    regressed = False
+    old, new = baseline['result']['chunks_per_sec'], result['chunks_per_sec']
+    change = (new - old) / old if old else 0.0
+    print(f"chunks/sec: {old:.1f} -> {new:.1f} ({change:+.1%}) vs {baseline.get('revision') or 'baseline'}")
+    if change < -tolerance:
+        regressed = True
+    old_stages = {s['stage']: s for s in baseline['result']['stages']}
+    for stage in result['stages']:
+        before = old_stages.get(stage['stage'])
+        if before is None:
+            continue
+        old_p95, new_p95 = before['latency_ms']['p95'], stage['latency_ms']['p95']
+        print(f"  {stage['stage']:>8} p95 latency: {old_p95:.2f} -> {new_p95:.2f} ms")
+    old_rss, new_rss = baseline['result']['peak_rss_mb']['self'], result['peak_rss_mb']['self']
+    print(f"peak RSS: {old_rss:.0f} -> {new_rss:.0f} MB")
+    if old_rss and (new_rss - old_rss) / old_rss > tolerance:
+        regressed = True
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark create_vectorsV4 ingestion with fake backends.")
+    parser.add_argument("--pdf", action="append", default=[], help="Real PDF to include (repeatable).")
+    parser.add_argument("--synthetic", type=int, default=10, help="Number of synthetic PDFs to generate.")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per synthetic PDF.")
+    parser.add_argument("--workers", type=int, default=1, help="PDF extraction processes.")
+    parser.add_argument("--embed-latency-ms", type=float, default=150.0)
+    parser.add_argument("--embed-error-rate", type=float, default=0.0)
+    parser.add_argument("--embed-rate-limit", type=int, default=0, help="Embed requests per minute, 0 = unlimited.")
+    parser.add_argument("--index-latency-ms", type=float, default=50.0)
+    parser.add_argument("--index-error-rate", type=float, default=0.0)
+    parser.add_argument("--index-rate-limit", type=int, default=0, help="Index requests per minute, 0 = unlimited.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter as a fraction of latency.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the result JSON here.")
+    parser.add_argument("--baseline", help="Earlier result JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed relative slowdown before --baseline reports a regression.")
+    args = parser.parse_args()
+
+    synthetic_dir = tempfile.mkdtemp(prefix='bench_pdfs_')
+    try:
+        pdf_paths = make_synthetic_pdfs(synthetic_dir, args.synthetic, args.pages, args.seed) + args.pdf
+        embed_backend = FakeBackend('embed', args.embed_latency_ms, args.embed_latency_ms * args.jitter,
+                                    args.embed_error_rate, args.embed_rate_limit, args.seed)
+        index_backend = FakeBackend('index', args.index_latency_ms, args.index_latency_ms * args.jitter,
+                                    args.index_error_rate, args.index_rate_limit, args.seed + 1)
+        result = run_benchmark(pdf_paths, args.workers, embed_backend, index_backend)
+    finally:
+        shutil.rmtree(synthetic_dir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'ingest',
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'config': vars(args),
+        'result': result,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare_to_baseline(result, baseline, args.tolerance):
+            print("Regression detected.")
+            sys.exit(1)
@@ -0,0 +1,163 @@
+# chunk_store.py
+import os
+import sqlite3
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Optional: zlib is used when it is not installed
+    zstandard = None
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class ChunkStore:
+    """
+    Persistent SQLite store of chunk texts keyed by vector ID, compressed with zstd when the
+    zstandard package is installed and zlib otherwise. The codec is stored per row, so a
+    store written with one codec stays readable after switching.
+
+    The index keeps only IDs and small metadata; the query path reads the texts it needs
+    from here in one lookup. WAL mode lets the ingestion script write while the app reads.
+
+    When the index holds reduced-dimension vectors, the full-dimension ones are kept here too
+    (as raw float32, which does not compress) so that candidates can be rescored exactly.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            'id TEXT PRIMARY KEY, codec TEXT NOT NULL, raw_bytes INTEGER NOT NULL, data BLOB NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS vectors (id TEXT PRIMARY KEY, dim INTEGER NOT NULL, data BLOB NOT NULL)'
+        )
+        self._conn.commit()
+        self.codec = 'zstd' if zstandard is not None else 'zlib'
+
+    def _compress(self, raw):
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+        return zlib.compress(raw, ZLIB_LEVEL)
+
+    @staticmethod
+    def _decompress(codec, data):
+        if codec == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("this chunk was stored with zstd; install the zstandard package to read it")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def put_many(self, items):
+        """
+        Stores (vector ID, text) pairs, replacing existing texts with the same ID.
+        """
+        rows = []
+        for vector_id, text in items:
+            raw = text.encode('utf-8')
+            rows.append((vector_id, self.codec, len(raw), self._compress(raw)))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO chunks (id, codec, raw_bytes, data) VALUES (?, ?, ?, ?)', rows
+            )
+            self._conn.commit()
+
+    def get_many(self, ids):
+        """
+        Returns a dict of vector ID -> text for the IDs that are stored.
+        """
+        found = {}
+        unique_ids = list(dict.fromkeys(ids))
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look up in slices
+            for start in range(0, len(unique_ids), 500):
+                chunk = unique_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT id, codec, data FROM chunks WHERE id IN ({placeholders})', chunk
+                ).fetchall()
+                for vector_id, codec, data in rows:
+                    try:
+                        found[vector_id] = self._decompress(codec, data).decode('utf-8')
+                    except Exception as e:
+                        print(f"Error reading chunk {vector_id} from the chunk store: {e}")
+        return found
+
+    def put_vectors(self, items):
+        """
+        Stores (vector ID, vector) pairs as float32, replacing existing vectors with the same ID.
+        """
+        import numpy as np  # Only needed for two-stage search, so not paid on import
+        rows = []
+        for vector_id, vector in items:
+            values = np.asarray(vector, dtype=np.float32)
+            rows.append((vector_id, len(values), values.tobytes()))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO vectors (id, dim, data) VALUES (?, ?, ?)', rows)
+            self._conn.commit()
+
+    def get_vectors(self, ids):
+        """
+        Returns a dict of vector ID -> float32 numpy array for the IDs that have a stored vector.
+        """
+        import numpy as np
+        found = {}
+        unique_ids = list(dict.fromkeys(ids))
+        with self._lock:
+            for start in range(0, len(unique_ids), 500):
+                chunk = unique_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT id, data FROM vectors WHERE id IN ({placeholders})', chunk
+                ).fetchall()
+                for vector_id, data in rows:
+                    found[vector_id] = np.frombuffer(data, dtype=np.float32)
+        return found
+
+    def delete_many(self, ids):
+        """
+        Deletes the texts and full-dimension vectors of these IDs.
+        """
+        ids = list(ids)
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                self._conn.execute(f'DELETE FROM chunks WHERE id IN ({placeholders})', chunk)
+                self._conn.execute(f'DELETE FROM vectors WHERE id IN ({placeholders})', chunk)
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Returns the number of stored chunks and their raw and compressed sizes in bytes,
+        and the number and size of stored full-dimension vectors.
+        """
+        with self._lock:
+            count, raw_bytes, stored_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(LENGTH(data)), 0) FROM chunks'
+            ).fetchone()
+            vectors, vector_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM vectors'
+            ).fetchone()
+        return {
+            'chunks': count,
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'compression_ratio': raw_bytes / stored_bytes if stored_bytes else 0.0,
+            'codec': self.codec,
+            'vectors': vectors,
+            'vector_bytes': vector_bytes,
+        }
@@ -0,0 +1,200 @@
+# chunker.py
+import bisect
+import re
+
+# Lengths are in characters; for English text one token is roughly 4 characters,
+# so the defaults are ~375-500 tokens, well under the embedding model's input limit.
+TARGET_CHARS = 1500
+MAX_CHARS = 2000
+OVERLAP_CHARS = 200
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+
+class Chunker:
+    """
+    Packs paragraphs (and, for long paragraphs, sentences) into chunks of roughly
+    `target_chars`, never more than `max_chars`, repeating up to `overlap_chars` of
+    whole sentences/paragraphs from the end of one chunk at the start of the next.
+
+    Pages are fed one at a time with add_page(), so a document is never held in memory
+    as one string. Each chunk is a dict with its text, the first and last page it spans
+    and its character offsets in the document (pages joined by newlines).
+    """
+
+    def __init__(self, target_chars=TARGET_CHARS, max_chars=MAX_CHARS, overlap_chars=OVERLAP_CHARS):
+        if not 0 < target_chars <= max_chars:
+            raise ValueError("target_chars must be positive and no larger than max_chars.")
+        if not 0 <= overlap_chars < target_chars:
+            raise ValueError("overlap_chars must be smaller than target_chars.")
+        self.target_chars = target_chars
+        self.max_chars = max_chars
+        self.overlap_chars = overlap_chars
+        self._page_starts = []  # Document offset where each page begins
+        self._page_numbers = []
+        self._length = 0  # Document length fed so far
+        self._carry = ''  # Text after the last paragraph break, may continue on the next page
+        self._carry_start = 0
+        self._units = []  # (text, start, end, starts_paragraph) of the chunk being built
+        self._size = 0
+
+    def add_page(self, page_no, text):
+        """
+        Feeds one page and yields the chunks it completes.
+        """
+        self._page_starts.append(self._length)
+        self._page_numbers.append(page_no)
+        text += '\n'
+        self._length += len(text)
+        buffer, buffer_start = self._carry + text, self._carry_start
+        pos = 0
+        for match in _PARAGRAPH_BREAK.finditer(buffer):
+            yield from self._add_paragraph(buffer[pos:match.start()], buffer_start + pos)
+            pos = match.end()
+        self._carry, self._carry_start = buffer[pos:], buffer_start + pos
+
+    def finish(self):
+        """
+        Yields the remaining chunk(s) at the end of the document.
+        """
+        yield from self._add_paragraph(self._carry, self._carry_start)
+        self._carry = ''
+        if self._units:
+            yield self._make_chunk()
+            self._units, self._size = [], 0
+
+    def chunk_pages(self, pages):
+        """
+        Convenience wrapper: chunks an iterable of (page_no, text) pairs.
+        """
+        for page_no, text in pages:
+            yield from self.add_page(page_no, text)
+        yield from self.finish()
+
+    def _add_paragraph(self, text, start):
+        stripped = text.strip()
+        if not stripped:
+            return
+        start += len(text) - len(text.lstrip())
+        if len(stripped) <= self.max_chars:
+            yield from self._add_unit(stripped, start, True)
+            return
+        # Too long for one chunk: fall back to sentences, and hard-split any monster sentence
+        pos = 0
+        first = True
+        for sentence in _SENTENCE_BREAK.split(stripped):
+            offset = stripped.index(sentence, pos)
+            pos = offset + len(sentence)
+            for piece_start, piece in self._split_long(sentence):
+                yield from self._add_unit(piece, start + offset + piece_start, first)
+                first = False
+
+    def _split_long(self, text):
+        """
+        Splits text longer than max_chars at whitespace (or hard, if there is none).
+        """
+        pos = 0
+        while len(text) - pos > self.max_chars:
+            cut = text.rfind(' ', pos, pos + self.max_chars)
+            if cut <= pos:
+                cut = pos + self.max_chars
+            yield pos, text[pos:cut]
+            pos = cut
+            while pos < len(text) and text[pos] == ' ':
+                pos += 1
+        yield pos, text[pos:]
+
+    @staticmethod
+    def _separator_size(starts_paragraph):
+        # Units are joined with a blank line at paragraph starts and a space otherwise (see _make_chunk)
+        return 2 if starts_paragraph else 1
+
+    def _add_unit(self, text, start, starts_paragraph):
+        separator = self._separator_size(starts_paragraph)
+        if self._units and (self._size >= self.target_chars
+                            or self._size + separator + len(text) > self.max_chars):
+            yield self._make_chunk()
+            # Start the next chunk with the trailing units that fit in the overlap budget
+            overlap, overlap_size = [], 0
+            for unit in reversed(self._units[1:]):
+                size = len(unit[0]) + (self._separator_size(overlap[0][3]) if overlap else 0) + overlap_size
+                if size > self.overlap_chars:
+                    break
+                overlap.insert(0, unit)
+                overlap_size = size
+            if overlap and overlap_size + separator + len(text) > self.max_chars:
+                overlap, overlap_size = [], 0
+            self._units, self._size = overlap, overlap_size
+        self._size += len(text) + (separator if self._units else 0)
+        self._units.append((text, start, start + len(text), starts_paragraph))
+
+    def _page_at(self, offset):
+        return self._page_numbers[max(bisect.bisect_right(self._page_starts, offset) - 1, 0)]
+
+    def _make_chunk(self):
+        parts = []
+        for i, (text, _, _, starts_paragraph) in enumerate(self._units):
+            if i:
+                parts.append('\n\n' if starts_paragraph else ' ')
+            parts.append(text)
+        char_start, char_end = self._units[0][1], self._units[-1][2]
+        return {
+            'text': ''.join(parts),
+            'page_start': self._page_at(char_start),
+            'page_end': self._page_at(char_end - 1),
+            'char_start': char_start,
+            'char_end': char_end,
+        }
+
+
+if __name__ == "__main__":
+    """
+    Compares this chunker with the old split('\\n\\n') heuristic on a PDF:
+        python chunker.py documents/DS_interview.pdf
+    Add --embed to also time embedding both chunk sets (needs API keys).
+    """
+    import argparse
+    import math
+    import time
+
+    import fitz  # PyMuPDF
+
+    parser = argparse.ArgumentParser(description="Compare chunkers on a PDF.")
+    parser.add_argument("pdf_path")
+    parser.add_argument("--target-chars", type=int, default=TARGET_CHARS)
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS)
+    parser.add_argument("--overlap-chars", type=int, default=OVERLAP_CHARS)
+    parser.add_argument("--embed", action="store_true", help="Also time embedding each chunk set.")
+    args = parser.parse_args()
+
+    with fitz.open(args.pdf_path) as doc:
+        pages = [(page.number, page.get_text()) for page in doc]
+
+    start = time.perf_counter()
+    full_text = ''.join(text + '\n' for _, text in pages)
+    old_chunks = [chunk for chunk in full_text.split('\n\n') if chunk.strip()]
+    old_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunker = Chunker(args.target_chars, args.max_chars, args.overlap_chars)
+    new_chunks = [chunk['text'] for chunk in chunker.chunk_pages(pages)]
+    new_seconds = time.perf_counter() - start
+
+    def report(name, chunks, seconds):
+        sizes = sorted(len(chunk) for chunk in chunks) or [0]
+        print(f"{name}: {len(chunks)} chunks, chars min {sizes[0]} / median {sizes[len(sizes) // 2]} "
+              f"/ max {sizes[-1]}, {sum(size < 100 for size in sizes)} under 100 chars, "
+              f"{sum(size > args.max_chars for size in sizes)} over {args.max_chars}, "
+              f"{math.ceil(len(chunks) / 100)} embed requests at batch size 100, chunked in {seconds * 1000:.1f} ms")
+
+    print(f"{args.pdf_path}: {len(pages)} pages, {len(full_text)} characters")
+    report("split('\\n\\n')", old_chunks, old_seconds)
+    report("Chunker", new_chunks, new_seconds)
+
+    if args.embed:
+        from create_vectorsV4 import embed_texts
+        for name, chunks in (("split('\\n\\n')", old_chunks), ("Chunker", new_chunks)):
+            start = time.perf_counter()
+            embed_texts(chunks)
+            print(f"{name}: embedded in {time.perf_counter() - start:.2f} s (cached chunks are not re-sent)")
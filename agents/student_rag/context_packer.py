@@ -0,0 +1,119 @@
+# context_packer.py
+# Packs retrieved passages into the prompt context within a token budget.
+#
+# Token counts are estimates: Llama 3's own tokenizer is not available here, so they come from
+# tiktoken's cl100k_base encoding when tiktoken is installed (close to, but not the same as,
+# Llama 3's) and from the text length at about 4 characters per token otherwise. Keep
+# CONTEXT_TOKEN_BUDGET well below the model's window to absorb the difference.
+import os
+from collections import namedtuple
+
+from dedup import Deduplicator
+
+try:
+    import tiktoken
+except ImportError:  # Optional: without it tokens are estimated from the text length
+    tiktoken = None
+
+# llama3-70b-8192 has an 8k window; this leaves room for the system prompt, question and answer
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_DEDUP_THRESHOLD = 0.8  # Estimated Jaccard similarity above which a passage is a near duplicate
+MAX_SCORE_GAP = 0.1  # Candidates after a drop in score larger than this are cut
+MIN_TRUNCATED_TOKENS = 64  # A passage is only cut down to fit if at least this much of it fits
+
+# One retrieved text: `header` introduces it in the prompt, `score` is its similarity to the question
+Passage = namedtuple('Passage', ['id', 'source', 'score', 'header', 'text'])
+
+_encoding = None
+
+
+def _get_encoding():
+    """
+    The tiktoken encoding (cl100k_base, close to but not the Llama 3 tokenizer), or None if unavailable.
+    """
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            # The encoding is downloaded on first use, which fails offline
+            print(f"Could not load tiktoken encoding, estimating token counts instead: {e}")
+            tiktoken = None
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Estimated token count of `text` (see the note at the top of this file).
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Roughly 4 characters per token for English text
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def pack_context(passages, budget_tokens=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+                 max_score_gap=MAX_SCORE_GAP):
+    """
+    Builds the prompt context from retrieved passages of any source.
+
+    Passages are taken in order of score. The list is cut at the first drop in score larger
+    than `max_score_gap` (an adaptive top_k), near duplicates of passages already taken are
+    skipped, and passages are added until `budget_tokens` is used up; the last one is
+    shortened to fit if enough of it does.
+
+    Returns (context text, report) where the report lists the packed passage IDs, the tokens
+    used in total and per source, and how many passages were dropped for each reason.
+    """
+    ordered = sorted(passages, key=lambda passage: passage.score, reverse=True)
+    kept = ordered[:1]
+    for previous, passage in zip(ordered, ordered[1:]):
+        if previous.score - passage.score > max_score_gap:
+            break
+        kept.append(passage)
+
+    deduplicator = Deduplicator(threshold=dedup_threshold)
+    parts, ids, per_source = [], [], {}
+    used = 0
+    duplicates = over_budget = 0
+    for passage in kept:
+        if deduplicator.check(passage.id, passage.text) is not None:
+            duplicates += 1
+            continue
+        header_tokens = count_tokens(passage.header) + 1
+        text_tokens = count_tokens(passage.text)
+        remaining = budget_tokens - used - header_tokens
+        text = passage.text
+        if text_tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                over_budget += 1
+                continue
+            text = truncate_to_tokens(text, remaining)
+            text_tokens = count_tokens(text)
+        parts.append(f"{passage.header}\n{text}")
+        ids.append(passage.id)
+        used += header_tokens + text_tokens
+        source = per_source.setdefault(passage.source, {'passages': 0, 'tokens': 0})
+        source['passages'] += 1
+        source['tokens'] += header_tokens + text_tokens
+
+    report = {
+        'ids': ids,
+        'tokens': used,
+        'budget_tokens': budget_tokens,
+        'tokenizer': 'cl100k_base' if _get_encoding() is not None else '4 characters per token',
+        'per_source': per_source,
+        'candidates': len(ordered),
+        'cut_by_score': len(ordered) - len(kept),
+        'duplicates': duplicates,
+        'over_budget': over_budget,
+    }
+    return "\n\n".join(parts), report
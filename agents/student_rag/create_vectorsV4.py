@@ -1,62 +1,325 @@
 # create_vectorsV2.py
-from pinecone import Pinecone
-from google import genai
+# The Pinecone, google-genai, PyMuPDF and numpy imports are deferred to first use: together they
+# take most of a second to import, and student_ragV7.py imports this module on every run.
+# The embedding cache and chunk store are opened on first use too.
 # from langchain.embeddings import HuggingFaceEmbeddings
 from dotenv import load_dotenv
 import os
-import fitz  # PyMuPDF
 import io   # Import io to handle byte streams
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import EmbeddingCache, cache_key
+from ingest_manifest import IngestManifest, chunk_id
+from pdf_extraction import iter_page_ranges_parallel
+from ingest_pipeline import Pipeline, print_stage_report
+from chunker import Chunker, TARGET_CHARS, MAX_CHARS, OVERLAP_CHARS
+from dedup import Deduplicator
+from ingest_journal import IngestJournal
+from query_cache import TTLCache, normalize_query
+from chunk_store import ChunkStore
 
 load_dotenv()
 # Get API keys from environment variables
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "my-first-db") # Make sure this index name is correct
 
-# Check if API keys are loaded
-if not PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY not found in environment variables. Please check your .env file.")
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in environment variables. Please check your .env file.")
+# Clients are built on first use and only when their key is set, so the module can be
+# imported quickly, offline and without keys (bench_ingest.py does that and plugs in
+# local stand-ins through use_backends)
+_pinecone_client = None
+_vector_index = None
+_embedding_client = None
+_clients_lock = threading.Lock()
 
-pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
-vector_index = pinecone_client.Index("my-first-db") # Make sure this index name is correct
+def get_pinecone_client():
+    """
+    Returns the Pinecone client, creating it on first call, or None if PINECONE_API_KEY is not set.
+    """
+    global _pinecone_client
+    with _clients_lock:
+        if _pinecone_client is None and PINECONE_API_KEY:
+            from pinecone import Pinecone
+            _pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
+        return _pinecone_client
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
+def get_vector_index():
+    """
+    Returns the Pinecone index, connecting on first call, or None if PINECONE_API_KEY is not set.
+    """
+    global _vector_index
+    if _vector_index is None:
+        pinecone_client = get_pinecone_client()
+        with _clients_lock:
+            if _vector_index is None and pinecone_client is not None:
+                _vector_index = pinecone_client.Index(PINECONE_INDEX_NAME)
+    return _vector_index
 
-def extract_text_from_pdf(pdf_path):
+def get_embedding_client():
     """
-    Extracts text from a PDF file on disk.
+    Returns the Gemini client, creating it on first call, or None if GOOGLE_API_KEY is not set.
+    """
+    global _embedding_client
+    with _clients_lock:
+        if _embedding_client is None and GOOGLE_API_KEY:
+            from google import genai
+            _embedding_client = genai.Client(api_key=GOOGLE_API_KEY)
+        return _embedding_client
+
+def __getattr__(name):
+    """
+    Keeps `from create_vectorsV4 import pinecone_client, vector_index` (and the embedding cache
+    and chunk store) working (PEP 562); such an import builds the object right away, so new
+    code should call the accessors.
+    """
+    if name == 'pinecone_client':
+        return get_pinecone_client()
+    if name == 'vector_index':
+        return get_vector_index()
+    if name == 'client':
+        return get_embedding_client()
+    if name == 'embedding_cache':
+        return get_embedding_cache()
+    if name == 'chunk_store':
+        return get_chunk_store()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warm_up():
     """
-    text = ""
+    Imports PyMuPDF, opens the local stores, builds both clients and opens the Pinecone connection ahead of the first
+    request, e.g. from a background thread at server start. Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    import fitz  # noqa: F401  PyMuPDF, imported here only to pay its import cost before the first upload
     try:
+        get_embedding_cache()
+        get_chunk_store()
+        get_embedding_client()
+        index = get_vector_index()
+        if index is not None:
+            index.describe_index_stats()
+    except Exception as e:
+        # The first real request will retry and report the error
+        print(f"Warm-up could not set up the clients: {e}")
+    return time.perf_counter() - start
+
+def _require(backend, key_name):
+    """
+    Returns `backend`, or raises the usual missing-key error if it was never configured.
+    """
+    if backend is None:
+        raise ValueError(f"{key_name} not found in environment variables. Please check your .env file.")
+    return backend
+
+def use_backends(embedding_client=None, index=None, embedding_cache=None, chunk_store=None):
+    """
+    Replaces the Gemini client, the Pinecone index, the embedding cache and/or the chunk store
+    used by this module, e.g. with the fakes in bench_ingest.py. Anything passed as None is
+    left as it is.
+    """
+    global _embedding_client, _vector_index, _embedding_cache, _chunk_store
+    with _clients_lock:
+        if embedding_client is not None:
+            _embedding_client = embedding_client
+        if index is not None:
+            _vector_index = index
+        if embedding_cache is not None:
+            _embedding_cache = embedding_cache
+        if chunk_store is not None:
+            _chunk_store = chunk_store
+
+def iter_pdf_pages(pdf_path, raise_errors=False):
+    """
+    Yields the text of each page of a PDF file on disk, one page at a time.
+    With `raise_errors`, an extraction error is raised instead of ending the pages early.
+    """
+    try:
+        import fitz  # PyMuPDF
         with fitz.open(pdf_path) as doc:
             for page in doc:
-                text += page.get_text() + '\n'
+                yield page.get_text()
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error extracting text from PDF file {pdf_path}: {e}")
         # Depending on requirements, you might want to raise the error
-        # Returning empty string for now
-    return text
+        # Stopping here keeps the pages extracted so far
 
-def extract_text_from_uploaded_pdf(uploaded_file):
+def extract_text_from_pdf(pdf_path):
     """
-    Extracts text from a Streamlit st.uploaded_file object (PDF).
-    This function is used for processing PDFs uploaded by users in the Streamlit app.
+    Extracts text from a PDF file on disk.
+    """
+    # join instead of repeated += so large PDFs are not copied once per page
+    return ''.join(page_text + '\n' for page_text in iter_pdf_pages(pdf_path))
+
+def iter_uploaded_pdf_pages(uploaded_file):
+    """
+    Yields the text of each page of a Streamlit st.uploaded_file object (PDF), one page at a time.
     """
-    text = ""
     try:
         # Read the file content as bytes
         # uploaded_file.getvalue() returns the file's content as bytes
         # io.BytesIO treats these bytes as an in-memory binary file
         file_bytes = uploaded_file.getvalue()
+        import fitz  # PyMuPDF
         with fitz.open(stream=io.BytesIO(file_bytes)) as doc:
             for page in doc:
-                text += page.get_text() + '\n'
+                yield page.get_text()
     except Exception as e:
         print(f"Error extracting text from uploaded PDF: {e}")
-        # Returning empty string allows the app to continue, perhaps warning the user.
-        # You could also choose to re-raise the exception if you want the app to stop.
-    return text
+        # Stopping here keeps the pages extracted so far, the app can warn the user
+
+def extract_text_from_uploaded_pdf(uploaded_file):
+    """
+    Extracts text from a Streamlit st.uploaded_file object (PDF).
+    This function is used for processing PDFs uploaded by users in the Streamlit app.
+    Returns an empty string if the file could not be read.
+    """
+    return ''.join(page_text + '\n' for page_text in iter_uploaded_pdf_pages(uploaded_file))
+
+# Embedding model settings shared by single and batched calls
+EMBEDDING_MODEL = 'gemini-embedding-001'
+EMBEDDING_DIM = 1024  # Dimension requested from Gemini and used for the final ranking
+EMBEDDING_BATCH_SIZE = 100  # Gemini accepts up to 100 contents per embed request
+
+# Two-stage search: with INDEX_DIM below EMBEDDING_DIM, Pinecone holds only the first INDEX_DIM
+# values of each embedding (renormalized; Gemini embeddings are trained so that prefixes work),
+# queries over-fetch RESCORE_OVERFETCH times the candidates from it, and those are re-ranked
+# with the full vectors kept in the chunk store. INDEX_DIM must match your Pinecone index
+# dimension, so changing it means a new index (PINECONE_INDEX_NAME) and a fresh ingest
+# (delete .cache/ingest_manifest.json). Pick the dimension with bench_dimensions.py.
+INDEX_DIM = int(os.getenv("INDEX_DIM", str(EMBEDDING_DIM)))
+RESCORE_OVERFETCH = int(os.getenv("RESCORE_OVERFETCH", "4"))
+RESCORING = INDEX_DIM < EMBEDDING_DIM
+
+# On-disk embedding cache, shared by this script and the student_rag app
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings.sqlite3")
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# Chunk texts live in a local compressed store keyed by vector ID instead of in Pinecone
+# metadata; the app must be able to read the store the ingestion script writes
+CHUNK_STORE_PATH = os.getenv(
+    "CHUNK_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "chunks.sqlite3")
+)
+
+_embedding_cache = None
+_chunk_store = None
+
+def get_embedding_cache():
+    """
+    Returns the on-disk embedding cache, opening it (and creating .cache/) on first call.
+    """
+    global _embedding_cache
+    with _clients_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+        return _embedding_cache
+
+def get_chunk_store():
+    """
+    Returns the chunk store, opening it (and creating .cache/) on first call.
+    """
+    global _chunk_store
+    with _clients_lock:
+        if _chunk_store is None:
+            _chunk_store = ChunkStore(CHUNK_STORE_PATH)
+        return _chunk_store
+
+def attach_chunk_texts(matches):
+    """
+    Adds each match's chunk text (from the chunk store) to its metadata, reading all texts in
+    one lookup. Vectors upserted before the chunk store existed still carry their text in
+    metadata and are used as they are; matches without any text are dropped.
+    Returns new {'id', 'score', 'metadata'} dicts.
+    """
+    texts = get_chunk_store().get_many([match['id'] for match in matches])
+    with_text = []
+    for match in matches:
+        metadata = dict(match.get('metadata') or {})
+        text = texts.get(match['id'], metadata.get('text'))
+        if text is None:
+            print(f"Warning: no text stored for vector {match['id']}")
+            continue
+        metadata['text'] = text
+        with_text.append({'id': match['id'], 'score': match['score'], 'metadata': metadata})
+    return with_text
+
+def reduce_vector(vector, dim=INDEX_DIM):
+    """
+    Returns the first `dim` values of an embedding scaled back to unit length, as a list,
+    or the vector unchanged if it is not longer than `dim`.
+    """
+    if len(vector) <= dim:
+        return vector
+    import numpy as np
+    values = np.asarray(vector[:dim], dtype=np.float32)
+    norm = np.linalg.norm(values)
+    return (values / norm if norm else values).tolist()
+
+def store_chunks(items):
+    """
+    Writes (vector ID, text, full embedding) triples to the chunk store, including the full
+    vectors when two-stage search is on. Call before the vectors become searchable.
+    """
+    items = list(items)
+    get_chunk_store().put_many((vector_id, text) for vector_id, text, _ in items)
+    if RESCORING:
+        get_chunk_store().put_vectors((vector_id, vector) for vector_id, _, vector in items)
+
+def rescore(vector, matches):
+    """
+    Re-ranks index matches by cosine similarity of their full-dimension stored vectors to the
+    full query `vector`. Matches without a stored vector keep their index score.
+    """
+    import numpy as np
+    full_vectors = get_chunk_store().get_vectors([match['id'] for match in matches])
+    query = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm:
+        query = query / norm
+    rescored = []
+    for match in matches:
+        full = full_vectors.get(match['id'])
+        score = match['score']
+        if full is not None and len(full) == len(query):
+            full_norm = np.linalg.norm(full)
+            score = float(full @ query / full_norm) if full_norm else 0.0
+        rescored.append(dict(match, score=score))
+    rescored.sort(key=lambda match: match['score'], reverse=True)
+    return rescored
+
+def search_index(vector, top_k):
+    """
+    Returns the `top_k` Pinecone matches for a full-dimension query embedding, with their chunk
+    texts attached. In two-stage mode the index is searched with the reduced query for
+    top_k * RESCORE_OVERFETCH candidates, which are rescored at full precision.
+    """
+    index = _require(get_vector_index(), "PINECONE_API_KEY")
+    if not RESCORING:
+        matches = index.query(vector=vector, top_k=top_k, include_metadata=True)['matches']
+        return attach_chunk_texts(matches)
+    matches = index.query(vector=reduce_vector(vector), top_k=top_k * RESCORE_OVERFETCH,
+                          include_metadata=True)['matches']
+    return attach_chunk_texts(rescore(vector, matches)[:top_k])
+
+def _embed_contents(contents):
+    """
+    Sends one embed_content request and returns the vectors in input order.
+    """
+    result = _require(get_embedding_client(), "GOOGLE_API_KEY").models.embed_content(
+        model=EMBEDDING_MODEL,
+        contents=contents,
+        config={'output_dimensionality': EMBEDDING_DIM}
+    )
+    return [embedding.values for embedding in result.embeddings]
 
 # Function to embed text using Google Gemini
 def embed_text(text):
@@ -69,86 +332,595 @@ def embed_text(text):
         # Returning None here, handle this case in the calling function
         return None
 
+    key = cache_key(EMBEDDING_MODEL, EMBEDDING_DIM, text)
+    vector = get_embedding_cache().get(key)
+    if vector is not None:
+        return vector
+
     try:
-        # Use the correct method and parameters for Google Generative AI embedding
-        # Ensure 'gemini-embedding-001' is the correct model name for your use case
-        result = client.models.embed_content(
-            model='gemini-embedding-001', # Updated model name format
-            contents=text,
-            # Adjust output dimensionality if needed, matching your Pinecone index dimension
-            config={'output_dimensionality': 1024} 
-        )
-        # Extract the embedding vector from the result dictionary
-        # The key is 'embedding' (singular) for the first content item
-        vector = result.embeddings[0].values
+        # The first (and only) embedding belongs to our text
+        vector = _embed_contents(text)[0]
+        get_embedding_cache().put(key, vector)
         return vector
     except Exception as e:
         print(f"Error generating embedding for text: {e}")
         # Depending on requirements, you might want to retry, skip, or raise the error
         return None # Or handle the error as appropriate
 
+# In-memory cache of query embeddings, shared by every Streamlit session in this process
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2048"))
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+query_embedding_cache = TTLCache(max_entries=QUERY_CACHE_MAX_ENTRIES, ttl_seconds=QUERY_CACHE_TTL_SECONDS)
+
+def embed_query(query):
+    """
+    Embeds a user question, reusing the embedding of an earlier question with the same
+    normalized text (case and whitespace are ignored). Returns (vector, cache_hit).
+    """
+    key = (EMBEDDING_MODEL, EMBEDDING_DIM, normalize_query(query))
+    vector = query_embedding_cache.get(key)
+    if vector is not None:
+        return vector, True
+    vector = embed_text(query)
+    if vector is not None:
+        query_embedding_cache.put(key, vector)
+    return vector, False
+
+def embed_texts(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Generates embeddings for many texts, sending up to `batch_size` texts per request.
+
+    Returns a list the same length as `texts` with vectors in input order.
+    Empty texts and texts that could not be embedded get None, just like embed_text.
+    Texts already in the embedding cache are never sent to the API.
+
+    Throughput: N chunks cost ceil(N / batch_size) round trips instead of N, so at the
+    default batch size ingestion makes 100x fewer requests. Since ingestion time is
+    dominated by per-request network latency, wall time drops by roughly the same
+    factor until the per-request server time becomes the limit.
+    """
+    vectors = [None] * len(texts)
+    # Empty strings are skipped up front so they never take a slot in a batch
+    pending = [idx for idx, text in enumerate(texts) if text.strip()]
+    skipped = len(texts) - len(pending)
+    if skipped:
+        print(f"Warning: Skipping {skipped} empty text(s).")
+
+    keys = {idx: cache_key(EMBEDDING_MODEL, EMBEDDING_DIM, texts[idx]) for idx in pending}
+    cached = get_embedding_cache().get_many(list(keys.values()))
+    for idx in pending:
+        vectors[idx] = cached.get(keys[idx])
+    pending = [idx for idx in pending if vectors[idx] is None]
+
+    for start in range(0, len(pending), batch_size):
+        batch_idx = pending[start:start + batch_size]
+        try:
+            batch_vectors = _embed_contents([texts[idx] for idx in batch_idx])
+            for idx, vector in zip(batch_idx, batch_vectors):
+                vectors[idx] = vector
+            get_embedding_cache().put_many([(keys[idx], vectors[idx]) for idx in batch_idx])
+        except Exception as e:
+            # One bad item should not cost the whole batch, so retry items one by one
+            print(f"Error embedding batch of {len(batch_idx)} texts, retrying individually: {e}")
+            for idx in batch_idx:
+                try:
+                    vectors[idx] = _embed_contents(texts[idx])[0]
+                    get_embedding_cache().put(keys[idx], vectors[idx])
+                except Exception as item_error:
+                    print(f"Error generating embedding for text at index {idx}: {item_error}")
+
+    return vectors
+
+# Upsert batching settings
+UPSERT_MAX_BATCH_VECTORS = 100  # Pinecone recommends batches of up to 100 vectors
+UPSERT_MAX_BATCH_BYTES = 2 * 1024 * 1024  # Pinecone rejects requests larger than 2MB
+UPSERT_WORKERS = 4
+UPSERT_MAX_IN_FLIGHT = 8  # Batches built but not yet confirmed, bounds memory
+UPSERT_MAX_RETRIES = 3
+
+def _vector_size_bytes(item):
+    """
+    Estimates the serialized size of one (id, vector, metadata) tuple.
+    """
+    return len(json.dumps(item, separators=(',', ':')).encode('utf-8'))
+
+def batch_vectors(vectors, max_vectors=UPSERT_MAX_BATCH_VECTORS, max_bytes=UPSERT_MAX_BATCH_BYTES):
+    """
+    Groups (id, vector, metadata) tuples into batches bounded by vector count and serialized bytes.
+    Works on any iterable, so vectors can be produced lazily.
+    """
+    batch = []
+    batch_bytes = 0
+    for item in vectors:
+        item_bytes = _vector_size_bytes(item)
+        if batch and (len(batch) >= max_vectors or batch_bytes + item_bytes > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        # A single vector larger than max_bytes still goes out alone; Pinecone will report it
+        batch.append(item)
+        batch_bytes += item_bytes
+    if batch:
+        yield batch
+
+def _upsert_batch_with_retry(batch, max_retries):
+    """
+    Upserts one batch, retrying with jittered exponential backoff. Returns True on success.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            _require(get_vector_index(), "PINECONE_API_KEY").upsert(batch)
+            return True
+        except Exception as e:
+            if attempt == max_retries:
+                print(f"Error upserting batch starting at '{batch[0][0]}' after {attempt + 1} attempts: {e}")
+                return False
+            delay = (2 ** attempt) + random.uniform(0, 1)
+            print(f"Upsert of batch starting at '{batch[0][0]}' failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def upsert_in_batches(vectors, max_vectors=UPSERT_MAX_BATCH_VECTORS, max_bytes=UPSERT_MAX_BATCH_BYTES,
+                      workers=UPSERT_WORKERS, max_in_flight=UPSERT_MAX_IN_FLIGHT,
+                      max_retries=UPSERT_MAX_RETRIES, on_batch_done=None):
+    """
+    Upserts (id, vector, metadata) tuples to Pinecone in size-bounded batches from a small thread pool.
+
+    At most `max_in_flight` batches are queued or being sent at once, so memory stays bounded
+    even when `vectors` is a long generator. Each batch is retried on its own, so one failure
+    only loses that batch. `on_batch_done(batch, ok)` is called from a worker thread once a
+    batch succeeds or runs out of retries. Returns a dict of counts and the achieved vectors/sec.
+    """
+    stats = {'upserted': 0, 'failed': 0, 'batches': 0, 'failed_batches': 0, 'failed_ids': []}
+    stats_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    start_time = time.perf_counter()
+
+    def send(batch):
+        try:
+            ok = _upsert_batch_with_retry(batch, max_retries)
+            with stats_lock:
+                stats['batches'] += 1
+                if ok:
+                    stats['upserted'] += len(batch)
+                else:
+                    stats['failed'] += len(batch)
+                    stats['failed_batches'] += 1
+                    stats['failed_ids'].extend(vector_id for vector_id, _, _ in batch)
+            if on_batch_done is not None:
+                on_batch_done(batch, ok)
+        except Exception as e:
+            print(f"Error after upserting batch starting at '{batch[0][0]}': {e}")
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in batch_vectors(vectors, max_vectors, max_bytes):
+            in_flight.acquire()  # Blocks the producer while too many batches are outstanding
+            executor.submit(send, batch)
+
+    stats['seconds'] = time.perf_counter() - start_time
+    stats['vectors_per_sec'] = stats['upserted'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    print(f"Upserted {stats['upserted']} vectors in {stats['batches']} batches "
+          f"({stats['vectors_per_sec']:.1f} vectors/sec).")
+    if stats['failed']:
+        print(f"Warning: {stats['failed']} vectors in {stats['failed_batches']} batches failed to upsert.")
+    return stats
+
 # Function to upsert vectors to Pinecone
-def upsert_vectors_to_pinecone(document_texts):
-    """
-    Embeds a list of texts and upserts them to the Pinecone index.
-    """
-    upsert_data = []
-    for idx, text in enumerate(document_texts):
-        embedding = embed_text(text)
-        if embedding is not None: # Only upsert if embedding was successful
-            vector_id = f'doc-{idx}'
-            meta_data = {'text': text}
-            # Pinecone upsert expects a list of tuples: (id, vector, metadata)
-            upsert_data.append((vector_id, embedding, meta_data))
-        else:
-            print(f"Skipping text at index {idx} due to embedding failure.")
-    
-    if upsert_data: # Only upsert if there's data to upsert
-        vector_index.upsert(upsert_data)
-        print(f'{len(upsert_data)} vectors upserted successfully.')
-    else:
+def upsert_vectors_to_pinecone(document_texts, ids=None):
+    """
+    Embeds a list of texts in batches (see embed_texts) and upserts them to the Pinecone index
+    in size-bounded, concurrent batches (see upsert_in_batches).
+    Pass `ids` (one per text) to use stable vector IDs instead of positional 'doc-{idx}' ones.
+    """
+    embeddings = embed_texts(document_texts)
+    embed_failed = sum(1 for embedding in embeddings if embedding is None)
+    vector_ids = ids if ids is not None else [f'doc-{idx}' for idx in range(len(document_texts))]
+    # Texts go to the chunk store before their vectors become searchable
+    store_chunks((vector_ids[idx], text, embedding) for idx, (text, embedding)
+                 in enumerate(zip(document_texts, embeddings)) if embedding is not None)
+
+    def upsert_data():
+        for idx, (text, embedding) in enumerate(zip(document_texts, embeddings)):
+            if embedding is not None: # Only upsert if embedding was successful
+                vector_id = vector_ids[idx]
+                meta_data = {}  # The text itself is in the chunk store
+                # Pinecone upsert expects tuples: (id, vector, metadata)
+                yield (vector_id, reduce_vector(embedding), meta_data)
+            else:
+                print(f"Skipping text at index {idx} due to embedding failure.")
+
+    stats = upsert_in_batches(upsert_data())
+    stats['embed_failed'] = embed_failed
+    if not stats['batches']:
         print('No vectors to upsert.')
+    return stats
+
+def delete_vectors(ids, batch_size=1000):
+    """
+    Deletes vectors by ID from the Pinecone index (Pinecone accepts up to 1000 IDs per call)
+    and their texts and full vectors from the chunk store.
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        _require(get_vector_index(), "PINECONE_API_KEY").delete(ids=ids[start:start + batch_size])
+    get_chunk_store().delete_many(ids)
+    if ids:
+        print(f"Deleted {len(ids)} stale vectors.")
+
+INGEST_QUEUE_SIZE = 32  # Items buffered between pipeline stages
+
+def iter_document_pages(changed, workers=None, max_memory_mb=None):
+    """
+    Pipeline source: yields ('page', doc_key, page_no, text) for every page of the changed
+    files, followed by ('end', doc_key, None, error) once a file is done. `error` is None, or
+    a message if any of the file's pages could not be extracted.
+    """
+    doc_keys = {pdf_path: doc_key for doc_key, pdf_path, _, _ in changed}
+    pdf_paths = list(doc_keys)
+    if workers and workers > 1:
+        current_path, current_error = None, None
+        for pdf_path, first_page_no, page_texts, error in iter_page_ranges_parallel(pdf_paths, workers, max_memory_mb):
+            if pdf_path != current_path:
+                if current_path is not None:
+                    yield ('end', doc_keys[current_path], None, current_error)
+                current_path, current_error = pdf_path, None
+                print(f"Processing {pdf_path}...")
+            current_error = current_error or error
+            for page_no, page_text in enumerate(page_texts, start=first_page_no):
+                yield ('page', doc_keys[pdf_path], page_no, page_text)
+        if current_path is not None:
+            yield ('end', doc_keys[current_path], None, current_error)
+    else:
+        for pdf_path in pdf_paths:
+            print(f"Processing {pdf_path}...")
+            error = None
+            try:
+                for page_no, page_text in enumerate(iter_pdf_pages(pdf_path, raise_errors=True)):
+                    yield ('page', doc_keys[pdf_path], page_no, page_text)
+            except Exception as e:
+                error = str(e)
+                print(f"Error extracting text from PDF file {pdf_path}: {e}")
+            yield ('end', doc_keys[pdf_path], None, error)
+
+# Marks the end of a document after its chunks in the stream. `expected_ids` are the chunk
+# IDs that must be confirmed upserted before the file counts as done (set by dedup_stage).
+# `error` is set if extraction failed for some or all pages; such a file never counts as done.
+DocumentEnd = namedtuple('DocumentEnd', ['doc_key', 'chunk_ids', 'expected_ids', 'error'], defaults=[None])
+
+def chunk_stage(chunker_options=None):
+    """
+    Pipeline stage: packs pages into size-bounded chunks (see chunker.Chunker) and yields
+    ('chunk', doc_key, vector_id, chunk) for each distinct chunk, then a DocumentEnd
+    listing every chunk ID of the document and any extraction error.
+    """
+    def stage(items):
+        chunker = None
+        seen = {}
+        for kind, doc_key, page_no, page_text in items:
+            if chunker is None:
+                chunker = Chunker(**(chunker_options or {}))
+            if kind == 'page':
+                chunks = chunker.add_page(page_no, page_text)
+            else:
+                chunks = chunker.finish()
+            for chunk in chunks:
+                vector_id = chunk_id(doc_key, chunk['text'])
+                # Repeated chunks within a file share an ID, so keep only the first copy
+                if vector_id in seen:
+                    continue
+                seen[vector_id] = None
+                yield ('chunk', doc_key, vector_id, chunk)
+            if kind == 'end':
+                error = page_text  # 'end' items carry the extraction error in the text slot
+                if not seen and error is None:
+                    print(f"Warning: No text extracted from {doc_key}")
+                yield DocumentEnd(doc_key, list(seen), None, error)
+                chunker, seen = None, {}
+    return stage
+
+DEDUP_THRESHOLD = 0.9  # Estimated Jaccard similarity of word shingles
+
+def dedup_stage(deduplicator, indexed_ids, collapsed_by_doc):
+    """
+    Pipeline stage: drops exact and near-duplicate chunks before they are embedded, recording
+    {dropped ID: kept ID} per document in `collapsed_by_doc`, and drops chunks that are
+    already in the index. Indexed chunks still go through the deduplicator, so a new chunk
+    that repeats one of them is dropped too.
+    """
+    def stage(items):
+        passed = set()  # IDs sent on to be embedded in this run
+        doc_passed = []
+        for item in items:
+            if isinstance(item, DocumentEnd):
+                # The file is done once its own new chunks, and any new chunk its
+                # duplicates collapsed into, are confirmed upserted
+                collapsed = collapsed_by_doc.get(item.doc_key, {})
+                expected = set(doc_passed)
+                expected.update(kept_id for kept_id in collapsed.values() if kept_id in passed)
+                yield item._replace(expected_ids=expected)
+                doc_passed = []
+                continue
+            _, doc_key, vector_id, chunk = item
+            kept_id = deduplicator.check(vector_id, chunk['text'])
+            if kept_id is not None:
+                collapsed_by_doc.setdefault(doc_key, {})[vector_id] = kept_id
+                continue
+            if vector_id in indexed_ids.get(doc_key, ()):
+                continue
+            passed.add(vector_id)
+            doc_passed.append(vector_id)
+            yield item
+    return stage
+
+def embed_stage(failed_ids, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Pipeline stage: embeds chunks in batches (see embed_texts) and yields
+    (id, index vector, metadata) tuples ready for upsert. IDs that fail are added to `failed_ids`.
+    DocumentEnd markers are passed on after the batch holding the document's last chunk.
+    """
+    def embed_batch(batch):
+        vectors = embed_texts([chunk['text'] for _, _, _, chunk in batch], batch_size=batch_size)
+        # Texts go to the chunk store before their vectors become searchable
+        store_chunks((vector_id, chunk['text'], vector) for (_, _, vector_id, chunk), vector
+                     in zip(batch, vectors) if vector is not None)
+        for (_, doc_key, vector_id, chunk), vector in zip(batch, vectors):
+            if vector is None:
+                print(f"Skipping chunk {vector_id} due to embedding failure.")
+                failed_ids.add(vector_id)
+            else:
+                # Only small, filterable fields; the text is in the chunk store
+                meta_data = {
+                    'source': doc_key,
+                    'page_start': chunk['page_start'],
+                    'page_end': chunk['page_end'],
+                    'char_start': chunk['char_start'],
+                    'char_end': chunk['char_end'],
+                }
+                yield (vector_id, reduce_vector(vector), meta_data)
+
+    def stage(items):
+        batch = []
+        ended = []
+        for item in items:
+            if isinstance(item, DocumentEnd):
+                ended.append(item)
+                continue
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield from embed_batch(batch)
+                yield from ended
+                batch, ended = [], []
+        if batch:
+            yield from embed_batch(batch)
+        yield from ended
+    return stage
+
+class _CompletionTracker:
+    """
+    Works out when every expected chunk of a document has been confirmed upserted and then
+    calls `on_complete(document_end)`. Called from the upsert worker threads.
+    """
+
+    def __init__(self, failed_ids, on_complete):
+        self.failed_ids = failed_ids
+        self.on_complete = on_complete
+        self.confirmed = set()
+        self.pending = {}  # doc_key -> (IDs still unconfirmed, DocumentEnd)
+        self.completed = set()
+        self.extraction_failed = set()
+        self._lock = threading.Lock()
+
+    def document_ended(self, end):
+        if end.error is not None:
+            # Only part of the file was read: keep its old vectors and manifest entry for a retry
+            with self._lock:
+                self.extraction_failed.add(end.doc_key)
+            return
+        with self._lock:
+            remaining = set(end.expected_ids) - self.confirmed
+            if remaining & self.failed_ids:
+                return
+            if remaining:
+                self.pending[end.doc_key] = (remaining, end)
+                return
+        self._complete([end])
+
+    def batch_done(self, batch, ok):
+        ids = {vector_id for vector_id, _, _ in batch}
+        done = []
+        with self._lock:
+            if ok:
+                self.confirmed.update(ids)
+            else:
+                self.failed_ids.update(ids)
+            for doc_key, (remaining, end) in list(self.pending.items()):
+                if ok:
+                    remaining.difference_update(ids)
+                if remaining & self.failed_ids:
+                    del self.pending[doc_key]
+                elif not remaining:
+                    del self.pending[doc_key]
+                    done.append(end)
+        self._complete(done)
+
+    def _complete(self, ends):
+        for end in ends:
+            self.on_complete(end)
+            with self._lock:
+                self.completed.add(end.doc_key)
+
+def upsert_stage(tracker, journal=None):
+    """
+    Pipeline stage: upserts vectors as they arrive, journals every confirmed batch, hands
+    DocumentEnd markers to `tracker`, and finally yields the upsert stats.
+    """
+    def on_batch_done(batch, ok):
+        if ok and journal is not None:
+            vectors_by_doc = {}
+            for vector_id, _, meta_data in batch:
+                vectors_by_doc.setdefault(meta_data['source'], []).append(vector_id)
+            journal.record_upserted(vectors_by_doc)
+        tracker.batch_done(batch, ok)
+
+    def stage(items):
+        def vectors():
+            for item in items:
+                if isinstance(item, DocumentEnd):
+                    tracker.document_ended(item)
+                else:
+                    yield item
+        yield upsert_in_batches(vectors(), on_batch_done=on_batch_done)
+    return stage
+
+def ingest_changed_files(changed, manifest, workers=None, max_memory_mb=None, queue_size=INGEST_QUEUE_SIZE,
+                         chunker_options=None, dedup_threshold=DEDUP_THRESHOLD, journal=None, resume=False):
+    """
+    Streams new or changed files through pages -> chunker -> dedup -> embedder -> upserter,
+    with bounded queues between the stages.
+
+    As soon as all of a file's chunks are confirmed upserted, its stale vectors are deleted
+    and its manifest entry is saved, so finished files survive a crash. Confirmed batches
+    are written to `journal` (see ingest_journal.IngestJournal); with `resume`, chunks the
+    journal of a killed run lists as upserted are neither embedded nor upserted again.
+
+    `chunker_options` are passed to chunker.Chunker (target_chars, max_chars, overlap_chars).
+    Returns (upsert stats, per-stage stats).
+    """
+    indexed_ids = {doc_key: manifest.indexed_ids(doc_key) for doc_key, _, _, _ in changed}
+    if journal is not None:
+        if resume:
+            journaled = journal.load()
+            for doc_key in indexed_ids:
+                indexed_ids[doc_key] |= journaled.get(doc_key, set())
+            print(f"Resuming: {sum(len(ids) for ids in journaled.values())} chunks already upserted.")
+        journal.start(resume=resume)
+
+    files = {doc_key: (pdf_path, stat, sha) for doc_key, pdf_path, stat, sha in changed}
+    collapsed_by_doc = {}
+    failed_ids = set()
+    manifest_lock = threading.Lock()
+
+    def finish_file(end):
+        _, stat, sha = files[end.doc_key]
+        collapsed = collapsed_by_doc.get(end.doc_key, {})
+        live_ids = {vector_id for vector_id in end.chunk_ids if vector_id not in collapsed}
+        with manifest_lock:
+            delete_vectors(indexed_ids[end.doc_key] - live_ids)
+            manifest.record(end.doc_key, stat, sha, end.chunk_ids, collapsed)
+            manifest.save()
+
+    tracker = _CompletionTracker(failed_ids, finish_file)
+    deduplicator = Deduplicator(threshold=dedup_threshold)
+    pipeline = Pipeline(iter_document_pages(changed, workers, max_memory_mb), queue_size=queue_size, report_every=10)
+    pipeline.add_stage('chunk', chunk_stage(chunker_options))
+    pipeline.add_stage('dedup', dedup_stage(deduplicator, indexed_ids, collapsed_by_doc))
+    pipeline.add_stage('embed', embed_stage(failed_ids))
+    pipeline.add_stage('upsert', upsert_stage(tracker, journal))
+    completed = False
+    try:
+        results, stage_stats = pipeline.run()
+        upsert_stats = results[0]
+        incomplete = [doc_key for doc_key in files if doc_key not in tracker.completed]
+        for doc_key in incomplete:
+            # Its old manifest entry stays, so the next run retries this file
+            if doc_key in tracker.extraction_failed:
+                print(f"Warning: text extraction failed for {files[doc_key][0]}; "
+                      f"its previous vectors were kept and it will be retried next run.")
+            else:
+                print(f"Warning: {files[doc_key][0]} was not fully upserted; it will be retried next run.")
+        completed = not incomplete
+    finally:
+        if journal is not None:
+            journal.close(completed)
+
+    print(f"Dropped {deduplicator.exact_duplicates} exact and {deduplicator.near_duplicates} "
+          f"near-duplicate chunks before embedding.")
+    print_stage_report(stage_stats)
+    return upsert_stats, stage_stats
+
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "ingest_journal.jsonl")
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "ingest_manifest.json")
+
+def index_version():
+    """
+    Changes whenever an ingestion run saves the manifest, so answer caches can tell the index was
+    re-ingested. Returns None if nothing has been ingested from this checkout.
+    """
+    try:
+        return os.stat(MANIFEST_PATH).st_mtime_ns
+    except OSError:
+        return None
 
 if __name__ == "__main__":
     """
     Script to process PDFs from the 'documents' directory and upsert them to Pinecone.
-    This is the original functionality.
+    Only new or changed files are extracted and embedded; vectors of removed or edited
+    chunks are deleted, using the manifest of the previous run. Extraction, embedding and
+    upserting run as a streaming pipeline (see ingest_changed_files).
     """
-    document_texts = []
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embed the PDFs in 'documents' and upsert them to Pinecone.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes used for PDF text extraction (1 extracts serially in this process).")
+    parser.add_argument("--max-memory-mb", type=int, default=None,
+                        help="Address space ceiling for each extraction worker, in MB.")
+    parser.add_argument("--target-chars", type=int, default=TARGET_CHARS, help="Preferred chunk length.")
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS, help="Hard chunk length limit.")
+    parser.add_argument("--overlap-chars", type=int, default=OVERLAP_CHARS,
+                        help="Text repeated between consecutive chunks.")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Similarity above which a chunk is dropped as a near duplicate.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip chunks that an interrupted earlier run already upserted.")
+    args = parser.parse_args()
+
+    # Check if API keys are loaded
+    _require(get_vector_index(), "PINECONE_API_KEY")
+    _require(get_embedding_client(), "GOOGLE_API_KEY")
+
     documents_dir = 'documents' # Ensure this directory exists
     
     if not os.path.exists(documents_dir):
         print(f"Warning: Directory '{documents_dir}' not found. No documents will be processed.")
     else:
         try:
-            document_dirs = os.listdir(documents_dir)
-            if not document_dirs:
-                 print(f"Warning: Directory '{documents_dir}' is empty.")
-            for doc in document_dirs:
+            manifest = IngestManifest(MANIFEST_PATH)
+            pdf_paths = []
+            for doc in sorted(os.listdir(documents_dir)):
                 pdf_path = os.path.join(documents_dir, doc)
                 # Basic check to ensure it's a file (could be more robust)
                 if os.path.isfile(pdf_path) and pdf_path.lower().endswith('.pdf'):
-                    print(f"Processing {pdf_path}...")
-                    text = extract_text_from_pdf(pdf_path)
-                    # Simple chunking by double newlines - you might want a more sophisticated method
-                    chunks = [chunk for chunk in text.split('\n\n') if chunk.strip()]
-                    if chunks:
-                        document_texts.extend(chunks)
-                    else:
-                        # If splitting by \n\n yields nothing, add the whole text if it's not empty
-                        if text.strip():
-                            document_texts.append(text.strip())
-                        else:
-                            print(f"Warning: No text extracted from {pdf_path}")
+                    pdf_paths.append(pdf_path)
                 else:
                     print(f"Skipping {pdf_path} (not a .pdf file or not a file).")
+            if not pdf_paths:
+                print(f"Warning: No PDF files found in '{documents_dir}'.")
 
-            if document_texts:
-                print(f"Total text chunks extracted: {len(document_texts)}")
-                upsert_vectors_to_pinecone(document_texts)
-                print("Initial document processing & upserting completed.")
-            else:
-                print("No text was extracted from any documents. Nothing upserted to Pinecone.")
+            changed, removed = manifest.plan(documents_dir, pdf_paths)
+            print(f"{len(pdf_paths) - len(changed)} unchanged, {len(changed)} new or changed, "
+                  f"{len(removed)} removed file(s).")
+
+            if changed:
+                chunker_options = {'target_chars': args.target_chars, 'max_chars': args.max_chars,
+                                   'overlap_chars': args.overlap_chars}
+                ingest_changed_files(changed, manifest, args.workers, args.max_memory_mb,
+                                     chunker_options=chunker_options, dedup_threshold=args.dedup_threshold,
+                                     journal=IngestJournal(JOURNAL_PATH), resume=args.resume)
+
+            for doc_key in removed:
+                print(f"Removing vectors of deleted file {doc_key}...")
+                delete_vectors(manifest.indexed_ids(doc_key))
+                manifest.remove(doc_key)
+
+            manifest.save()
+            print("Document processing & upserting completed.")
+            print(f"Embedding cache: {get_embedding_cache().stats()}")
+            print(f"Chunk store: {get_chunk_store().stats()}")
+            if RESCORING:
+                print(f"Index holds {INDEX_DIM}-dim vectors, rescored with {EMBEDDING_DIM}-dim ones "
+                      f"({RESCORE_OVERFETCH}x over-fetch).")
 
         except Exception as e:
             print(f"An error occurred during initial document processing: {e}")
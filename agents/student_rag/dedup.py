@@ -0,0 +1,123 @@
+# dedup.py
+import hashlib
+import re
+
+from embedding_cache import normalize_text
+
+_WORD = re.compile(r'\w+')
+
+
+def _shingles(text, size):
+    """
+    Word n-grams of the lowercased text, hashed to 64-bit integers.
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        grams = [' '.join(words)] if words else []
+    else:
+        grams = [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return {int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'big')
+            for gram in grams}
+
+
+def _choose_bands(num_perm, threshold):
+    """
+    Picks the (bands, rows) split of the signature whose LSH threshold (1/b)^(1/r) is closest to `threshold`.
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class Deduplicator:
+    """
+    Drops exact duplicates (by hash of the normalized text) and near duplicates
+    (MinHash signatures bucketed with LSH, confirmed by estimated Jaccard similarity
+    of word shingles >= `threshold`).
+
+    `collapsed` maps every dropped chunk ID to the ID of the chunk that was kept.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=64, shingle_size=5):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _choose_bands(num_perm, threshold)
+        self._exact = {}  # text hash -> kept chunk ID
+        self._signatures = {}  # kept chunk ID -> MinHash signature
+        self._buckets = [{} for _ in range(self.bands)]
+        self.collapsed = {}
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def signature(self, text):
+        """
+        One-permutation MinHash: each shingle hash picks one of `num_perm` bins by its low bits
+        and the bin keeps the minimum of the remaining bits. This costs one pass over the
+        shingles instead of one pass per permutation. Empty bins borrow the value of the
+        next non-empty bin (rotation densification) so every position stays comparable.
+        """
+        shingles = _shingles(text, self.shingle_size)
+        if not shingles:
+            return None
+        bins = [None] * self.num_perm
+        for shingle in shingles:
+            slot, value = shingle % self.num_perm, shingle // self.num_perm
+            if bins[slot] is None or value < bins[slot]:
+                bins[slot] = value
+        signature = list(bins)
+        for i in range(self.num_perm):
+            distance = 1
+            while signature[i] is None:
+                borrowed = bins[(i + distance) % self.num_perm]
+                if borrowed is not None:
+                    # Offset by the distance so borrowed values differ from the originals
+                    signature[i] = borrowed + distance * (1 << 64)
+                distance += 1
+        return tuple(signature)
+
+    def _similarity(self, sig_a, sig_b):
+        return sum(x == y for x, y in zip(sig_a, sig_b)) / self.num_perm
+
+    def check(self, chunk_id, text):
+        """
+        Registers a chunk. Returns the ID of an earlier chunk it duplicates, or None if it should be kept.
+        """
+        text_hash = hashlib.sha256(normalize_text(text).lower().encode('utf-8')).hexdigest()
+        kept_id = self._exact.get(text_hash)
+        if kept_id is not None:
+            self.exact_duplicates += 1
+            self.collapsed[chunk_id] = kept_id
+            return kept_id
+
+        signature = self.signature(text)
+        if signature is None:
+            self._exact[text_hash] = chunk_id
+            return None
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+        candidates = set()
+        for band, key in zip(self._buckets, band_keys):
+            candidates.update(band.get(key, ()))
+        best_id, best_score = None, 0.0
+        for candidate in candidates:
+            score = self._similarity(signature, self._signatures[candidate])
+            if score >= self.threshold and score > best_score:
+                best_id, best_score = candidate, score
+        if best_id is not None:
+            self.near_duplicates += 1
+            self.collapsed[chunk_id] = best_id
+            # Later exact copies collapse onto the kept chunk too, never onto this dropped one
+            self._exact[text_hash] = best_id
+            return best_id
+
+        self._exact[text_hash] = chunk_id
+        self._signatures[chunk_id] = signature
+        for band, key in zip(self._buckets, band_keys):
+            band.setdefault(key, []).append(chunk_id)
+        return None
@@ -0,0 +1,123 @@
+# embedding_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+
+def normalize_text(text):
+    """
+    Normalizes text before hashing so whitespace-only differences share a cache entry.
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(model, dimensionality, text):
+    """
+    Content address of an embedding: (model name, output dimensionality, sha256 of normalized text).
+    """
+    text_hash = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return f"{model}:{dimensionality}:{text_hash}"
+
+
+class EmbeddingCache:
+    """
+    Persistent SQLite cache of embedding vectors with LRU eviction.
+
+    One cache file can be shared by the ingestion script and the Streamlit app;
+    SQLite's WAL mode lets several processes read and write it safely.
+    """
+
+    def __init__(self, path, max_entries=200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """
+        Looks up several keys at once. Returns a dict of key -> vector for the hits only.
+        """
+        found = {}
+        if not keys:
+            return found
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look up in slices
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE key = ?', [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def get(self, key):
+        """
+        Returns the cached vector for `key`, or None.
+        """
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """
+        Stores (key, vector) pairs and evicts the least recently used entries over the size cap.
+        """
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array('f', vector).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)', rows
+            )
+            size = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            if size > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM embeddings WHERE key IN '
+                    '(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)',
+                    (size - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def put(self, key, vector):
+        self.put_many([(key, vector)])
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this process and the number of stored entries.
+        """
+        with self._lock:
+            size = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': size,
+                'max_entries': self.max_entries,
+            }
@@ -0,0 +1,181 @@
+# flashcards.py
+import hashlib
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dedup import Deduplicator
+from query_cache import normalize_query
+
+FLASHCARD_MODEL = "llama3-70b-8192"
+MIN_ANSWER_CHARS = 500  # Shorter answers do not get flashcards
+FLASHCARD_WORKERS = 4
+SHARED_JOB_SECONDS = 300  # How long a finished shared job's cards are handed to late sessions
+FLASHCARD_DEDUP_THRESHOLD = 0.7  # Cards whose text is at least this similar are merged
+
+
+def parse_flashcards(text):
+    """
+    Returns the JSON array of {'front', 'back'} objects in an LLM reply, or None if there is none.
+    """
+    json_match = re.search(r'\[[\s\S]*\]', text)
+    if not json_match:
+        return None
+    return json.loads(json_match.group())
+
+
+def generate_answer_flashcards(groq_client, query, answer):
+    """
+    Asks the LLM for 2-3 flashcards about one question and its answer. Returns a list (empty on failure).
+    """
+    flashcard_prompt = f"""
+    Based on the question and answer, create 2-3 educational flashcards.
+    Format: [{{"front": "...", "back": "..."}}]
+    Question: {query}
+    Answer: {answer}
+    Flashcards:
+    """
+    try:
+        flashcard_response = groq_client.chat.completions.create(
+            model=FLASHCARD_MODEL,
+            messages=[
+                {"role": "system", "content": "Flashcard creator. JSON only."},
+                {"role": "user", "content": flashcard_prompt}
+            ],
+            temperature=0.3,
+            max_tokens=800
+        )
+        return parse_flashcards(flashcard_response.choices[0].message.content.strip()) or []
+    except Exception as e:
+        print(f"Error generating flashcards: {e}")
+        return []
+
+
+def answer_key(answer):
+    """
+    Identifies an answer's flashcard extract, independently of its position in the chat.
+    """
+    return hashlib.sha256(answer.encode('utf-8')).hexdigest()[:16]
+
+
+def merge_flashcards(decks, threshold=FLASHCARD_DEDUP_THRESHOLD):
+    """
+    Reduce step of the overall deck: concatenates per-answer decks in order, dropping cards with
+    the same front (ignoring case and whitespace) or with near-duplicate text, and malformed cards.
+    """
+    deduplicator = Deduplicator(threshold=threshold, shingle_size=3)
+    seen_fronts = set()
+    merged = []
+    for deck in decks:
+        for card in deck:
+            if not isinstance(card, dict) or not card.get('front') or not card.get('back'):
+                continue
+            front = normalize_query(str(card['front']))
+            if front in seen_fronts:
+                continue
+            if deduplicator.check(len(merged), f"{card['front']} {card['back']}") is not None:
+                continue
+            seen_fronts.add(front)
+            merged.append(card)
+    return merged
+
+
+class FlashcardWorker:
+    """
+    Generates flashcards on a background thread pool so the answer can be shown after a single
+    LLM round trip. Each session has at most one current job: submitting a new one cancels the
+    previous job if it has not started, and its result is discarded if it has.
+
+    Jobs submitted with submit_shared() under the same key (e.g. the answer_key of an answer that
+    several sessions got) run once; every session polls the same job, and sessions that submit
+    within SHARED_JOB_SECONDS after it finished get its result straight away.
+    """
+
+    def __init__(self, max_workers=FLASHCARD_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='flashcards')
+        self._jobs = {}  # session key -> current Future
+        self._shared = {}  # job key -> (Future, when it was first seen finished, or None)
+        self._lock = threading.Lock()
+        self.cancelled = 0
+        self.shared = 0  # Submissions that reused another session's job
+
+    def _drop(self, session_key):
+        """
+        Removes the session's current job and cancels it unless another session still waits on it.
+        Call with the lock held.
+        """
+        future = self._jobs.pop(session_key, None)
+        if future is None or future.done() or any(other is future for other in self._jobs.values()):
+            return
+        if future.cancel():
+            self.cancelled += 1
+
+    def submit(self, session_key, fn, *args, **kwargs):
+        with self._lock:
+            self._drop(session_key)
+            future = self._executor.submit(fn, *args, **kwargs)
+            self._jobs[session_key] = future
+            return future
+
+    def submit_shared(self, session_key, job_key, fn, *args, **kwargs):
+        """
+        Like submit(), but reuses the job already submitted under `job_key` if there is one
+        that is running, or that produced cards in the last SHARED_JOB_SECONDS.
+        """
+        with self._lock:
+            self._drop(session_key)
+            now = time.monotonic()
+            for key, (future, finished_at) in list(self._shared.items()):
+                if future.cancelled() or (finished_at is not None and now - finished_at > SHARED_JOB_SECONDS):
+                    del self._shared[key]
+                elif future.done() and finished_at is None:
+                    # Noted here rather than in a done callback, which could run while the lock is held
+                    self._shared[key] = (future, now)
+            shared = self._shared.get(job_key)
+            # A finished job is only reused if it produced cards
+            if shared is not None and (not shared[0].done() or (shared[0].exception() is None and shared[0].result())):
+                future = shared[0]
+                self.shared += 1
+            else:
+                future = self._executor.submit(fn, *args, **kwargs)
+                self._shared[job_key] = (future, None)
+            self._jobs[session_key] = future
+            return future
+
+    def map(self, fn, args_list):
+        """
+        Runs fn(*args) for every args tuple on the pool and returns the results in order.
+        """
+        return list(self._executor.map(lambda args: fn(*args), args_list))
+
+    def cancel(self, session_key):
+        """
+        Drops the session's current job, e.g. when the next question makes it stale.
+        """
+        with self._lock:
+            self._drop(session_key)
+
+    def pending(self, session_key):
+        with self._lock:
+            future = self._jobs.get(session_key)
+            return future is not None and not future.done()
+
+    def result(self, session_key):
+        """
+        Returns (True, flashcards) once the session's current job has finished, removing it,
+        and (False, None) while it is still running or if there is none.
+        """
+        with self._lock:
+            future = self._jobs.get(session_key)
+            if future is None or not future.done():
+                return False, None
+            del self._jobs[session_key]
+        if future.cancelled():
+            return False, None
+        try:
+            return True, future.result()
+        except Exception as e:
+            print(f"Error generating flashcards: {e}")
+            return True, []
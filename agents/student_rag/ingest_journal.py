@@ -0,0 +1,72 @@
+# ingest_journal.py
+import json
+import os
+import threading
+import time
+
+
+class IngestJournal:
+    """
+    Append-only JSON-lines journal of vectors confirmed upserted during an ingestion run.
+
+    Every confirmed batch is written and fsynced before the run moves on, so after a crash,
+    Ctrl-C or OOM kill the journal lists exactly which chunks already reached the index.
+    Files that finished completely are checkpointed in the manifest instead, and the journal
+    is cleared once a run completes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self):
+        """
+        Reads the journal left by an earlier run. Returns {doc_key: set of upserted vector IDs}.
+        A torn last line (the process died mid-write) is ignored.
+        """
+        upserted = {}
+        if not os.path.exists(self.path):
+            return upserted
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('event') == 'upserted':
+                    for doc_key, ids in event['vectors'].items():
+                        upserted.setdefault(doc_key, set()).update(ids)
+        return upserted
+
+    def start(self, resume=False):
+        """
+        Opens the journal for a new run. Without `resume` any earlier journal is discarded.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        self._append({'event': 'run', 'resume': resume, 'time': time.time()})
+
+    def _append(self, event):
+        with self._lock:
+            self._file.write(json.dumps(event) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def record_upserted(self, vectors_by_doc):
+        """
+        Records one confirmed batch as {doc_key: [vector IDs]}.
+        """
+        self._append({'event': 'upserted', 'vectors': vectors_by_doc})
+
+    def close(self, completed):
+        """
+        Closes the journal; a completed run deletes it since the manifest now covers everything.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if completed and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,131 @@
+# ingest_manifest.py
+import hashlib
+import json
+import os
+
+from embedding_cache import normalize_text
+
+
+def file_sha256(path):
+    """
+    Hashes a file's content in 1MB blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(doc_key, chunk_text):
+    """
+    Stable vector ID: <document key hash>:<chunk content hash>.
+
+    The document part comes from the file's path inside documents/, so editing a PDF
+    keeps the IDs of its unchanged chunks and only new or edited chunks are upserted.
+    """
+    doc_hash = hashlib.sha256(doc_key.encode('utf-8')).hexdigest()[:12]
+    text_hash = hashlib.sha256(normalize_text(chunk_text).encode('utf-8')).hexdigest()[:16]
+    return f"{doc_hash}:{text_hash}"
+
+
+class IngestManifest:
+    """
+    Records what has been ingested from each file: size, mtime, content hash, chunk IDs,
+    and which of those chunks were dropped as duplicates of another chunk.
+
+    Files are keyed by their path relative to the documents directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.files = json.load(f).get('files', {})
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not read manifest {path} ({e}); treating every file as new.")
+
+    def plan(self, documents_dir, pdf_paths):
+        """
+        Compares files on disk against the manifest.
+
+        Returns (changed, removed): `changed` is a list of (doc_key, path, stat, sha256) for new or
+        modified files, `removed` lists doc keys that are in the manifest but no longer on disk.
+        Files whose size and mtime match the manifest cost only a stat.
+        """
+        changed = []
+        seen = set()
+        for path in pdf_paths:
+            doc_key = os.path.relpath(path, documents_dir)
+            seen.add(doc_key)
+            stat = os.stat(path)
+            entry = self.files.get(doc_key)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            sha = file_sha256(path)
+            if entry and entry['sha256'] == sha:
+                # Touched but not modified: remember the new mtime so the next run is stat-only
+                entry['size'] = stat.st_size
+                entry['mtime'] = stat.st_mtime
+                continue
+            changed.append((doc_key, path, stat, sha))
+        removed = [doc_key for doc_key in self.files if doc_key not in seen]
+
+        # Chunks that were dropped as duplicates of a chunk in a removed or changed file
+        # lose their kept copy, so their files have to be processed again as well
+        affected_ids = set()
+        for doc_key in removed + [doc_key for doc_key, _, _, _ in changed]:
+            affected_ids.update(self.chunk_ids(doc_key))
+        changed_keys = {doc_key for doc_key, _, _, _ in changed}
+        for path in pdf_paths:
+            doc_key = os.path.relpath(path, documents_dir)
+            if doc_key in changed_keys:
+                continue
+            if affected_ids.intersection(self.collapsed(doc_key).values()):
+                changed.append((doc_key, path, os.stat(path), file_sha256(path)))
+        return changed, removed
+
+    def chunk_ids(self, doc_key):
+        """
+        Returns the chunk IDs previously recorded for a file (empty if unknown).
+        """
+        return self.files.get(doc_key, {}).get('chunk_ids', [])
+
+    def collapsed(self, doc_key):
+        """
+        Returns {dropped chunk ID: kept chunk ID} for the file's chunks that were deduplicated away.
+        """
+        return self.files.get(doc_key, {}).get('collapsed', {})
+
+    def indexed_ids(self, doc_key):
+        """
+        Returns the IDs of the file's chunks that actually have a vector in the index.
+        """
+        collapsed = self.collapsed(doc_key)
+        return {vector_id for vector_id in self.chunk_ids(doc_key) if vector_id not in collapsed}
+
+    def record(self, doc_key, stat, sha, chunk_ids, collapsed=None):
+        self.files[doc_key] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': sha,
+            'chunk_ids': list(chunk_ids),
+            'collapsed': dict(collapsed or {}),
+        }
+
+    def remove(self, doc_key):
+        self.files.pop(doc_key, None)
+
+    def save(self):
+        """
+        Writes the manifest atomically so a crash never leaves a half-written file.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,215 @@
+# ingest_pipeline.py
+import math
+import queue
+import random
+import threading
+import time
+
+_DONE = object()  # End-of-stream marker passed between stages
+MAX_LATENCY_SAMPLES = 10000  # Per stage, older samples are replaced at random beyond this
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers (0 for an empty list).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(max(math.ceil(pct / 100 * len(ordered)) - 1, 0), len(ordered) - 1)
+    return ordered[rank]
+
+
+class _Aborted(Exception):
+    pass
+
+
+class StageStats:
+    """
+    Counters for one pipeline stage. `wait_in` is time spent waiting for input, `wait_out` time
+    blocked on a full output queue; whatever is left of the stage's lifetime is its own work.
+    Per-item latency is the stage's own work between two consecutive outputs.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+        self.started = None
+        self.finished = None
+        self.max_queue_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self.latencies = []  # Busy seconds spent producing each output item (sampled)
+        self._latency_count = 0
+
+    def record_latency(self, seconds):
+        self._latency_count += 1
+        if len(self.latencies) < MAX_LATENCY_SAMPLES:
+            self.latencies.append(seconds)
+        else:
+            slot = random.randrange(self._latency_count)
+            if slot < MAX_LATENCY_SAMPLES:
+                self.latencies[slot] = seconds
+
+    def sample_depth(self, depth):
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self._depth_total += depth
+        self._depth_samples += 1
+
+    def as_dict(self):
+        elapsed = ((self.finished or time.perf_counter()) - self.started) if self.started else 0.0
+        busy = max(elapsed - self.wait_in - self.wait_out, 0.0)
+        return {
+            'stage': self.name,
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'seconds': elapsed,
+            'busy_seconds': busy,
+            'busy_fraction': busy / elapsed if elapsed else 0.0,
+            'items_per_sec': self.items_out / elapsed if elapsed else 0.0,
+            'avg_input_queue_depth': self._depth_total / self._depth_samples if self._depth_samples else 0.0,
+            'max_input_queue_depth': self.max_queue_depth,
+            'latency_ms': {
+                'p50': percentile(self.latencies, 50) * 1000,
+                'p95': percentile(self.latencies, 95) * 1000,
+                'p99': percentile(self.latencies, 99) * 1000,
+            },
+        }
+
+
+class Pipeline:
+    """
+    Runs a source iterable through a chain of stages, each in its own thread, with bounded
+    queues in between. A full queue blocks the stage before it, so memory stays flat no
+    matter how large the input is, and all stages work on different items at the same time.
+
+    A stage is a function that takes an iterator of items and yields items, which lets a
+    stage batch, split or drop items freely.
+    """
+
+    def __init__(self, source, queue_size=8, report_every=None):
+        self.source = source
+        self.queue_size = queue_size
+        self.report_every = report_every  # Seconds between progress prints, None to stay quiet
+        self.stages = []
+        self.stats = []
+        self._abort = threading.Event()
+        self._error = None
+
+    def add_stage(self, name, fn):
+        self.stages.append((name, fn))
+        return self
+
+    def _put(self, q, item, stats):
+        start = time.perf_counter()
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self._abort.is_set():
+                    raise _Aborted()
+        stats.wait_out += time.perf_counter() - start
+        if item is not _DONE:
+            stats.items_out += 1
+
+    def _iter_queue(self, q, stats):
+        while True:
+            start = time.perf_counter()
+            while True:
+                try:
+                    item = q.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if self._abort.is_set():
+                        raise _Aborted()
+            stats.wait_in += time.perf_counter() - start
+            if item is _DONE:
+                return
+            stats.items_in += 1
+            yield item
+
+    def _run_stage(self, fn, in_q, out_q, stats):
+        stats.started = time.perf_counter()
+        try:
+            if in_q is None:
+                items = iter(fn)  # The source is a plain iterable
+            else:
+                items = fn(self._iter_queue(in_q, stats))
+            last_output, waits = time.perf_counter(), 0.0
+            for item in items:
+                # Time since the previous output minus time spent waiting on the queues
+                now, total_waits = time.perf_counter(), stats.wait_in + stats.wait_out
+                stats.record_latency(max(now - last_output - (total_waits - waits), 0.0))
+                self._put(out_q, item, stats)
+                last_output, waits = time.perf_counter(), stats.wait_in + stats.wait_out
+            self._put(out_q, _DONE, stats)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            self._error = e
+            self._abort.set()
+        finally:
+            stats.finished = time.perf_counter()
+
+    def _monitor(self, queues):
+        last_report = time.perf_counter()
+        while not self._abort.wait(0.1):
+            # The queue feeding stage i is queues[i - 1]; the source has no input queue
+            for stats, q in zip(self.stats[1:], queues):
+                stats.sample_depth(q.qsize())
+            if self.report_every and time.perf_counter() - last_report >= self.report_every:
+                last_report = time.perf_counter()
+                print(' | '.join(f"{s.name}: {s.items_out} out" for s in self.stats)
+                      + ' | queues: ' + ' '.join(str(q.qsize()) for q in queues))
+
+    def run(self):
+        """
+        Runs the pipeline to completion and returns the items of the last stage as a list
+        (stages usually end in a small summary) along with per-stage stats.
+        Re-raises the first exception from any stage.
+        """
+        names = ['source'] + [name for name, _ in self.stages]
+        fns = [self.source] + [fn for _, fn in self.stages]
+        self.stats = [StageStats(name) for name in names]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in fns]
+
+        threads = []
+        for i, fn in enumerate(fns):
+            in_q = queues[i - 1] if i > 0 else None
+            thread = threading.Thread(target=self._run_stage, args=(fn, in_q, queues[i], self.stats[i]),
+                                      name=f"pipeline-{names[i]}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        monitor = threading.Thread(target=self._monitor, args=(queues,), daemon=True)
+        monitor.start()
+
+        results = []
+        sink_stats = StageStats('sink')
+        try:
+            for item in self._iter_queue(queues[-1], sink_stats):
+                results.append(item)
+        except _Aborted:
+            pass
+        finally:
+            self._abort.set()  # Also stops the monitor thread
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
+        return results, [s.as_dict() for s in self.stats]
+
+
+def print_stage_report(stage_stats):
+    """
+    Prints one line per stage; the stage with the highest busy fraction is the bottleneck.
+    """
+    bottleneck = max(stage_stats, key=lambda s: s['busy_fraction'], default=None)
+    for s in stage_stats:
+        marker = '  <- bottleneck' if s is bottleneck else ''
+        print(f"{s['stage']:>10}: {s['items_out']:>7} out, {s['items_per_sec']:8.1f}/s, "
+              f"busy {s['busy_fraction']:5.1%}, input queue avg {s['avg_input_queue_depth']:.1f} "
+              f"max {s['max_input_queue_depth']}{marker}")
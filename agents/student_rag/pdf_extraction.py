@@ -0,0 +1,102 @@
+# pdf_extraction.py
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+PAGES_PER_TASK = 16  # Large files are split into page ranges of this size
+
+
+def _limit_worker_memory(max_memory_mb):
+    """
+    Process pool initializer: caps the worker's address space so one huge PDF cannot exhaust the box.
+    """
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        # resource is POSIX-only; on other platforms the ceiling is not enforced
+        print(f"Warning: Could not set worker memory limit: {e}")
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """
+    Extracts the text of pages [start, stop) of one PDF. Runs inside a worker process.
+    Errors are raised to the parent, which reports the range as failed.
+    """
+    try:
+        import fitz  # PyMuPDF, imported on first use since only extraction needs it
+        with fitz.open(pdf_path) as doc:
+            return [doc[page_no].get_text() for page_no in range(start, stop)]
+    except MemoryError:
+        raise RuntimeError("worker memory limit exceeded") from None
+
+
+def _page_ranges(pdf_paths, pages_per_task):
+    """
+    Yields (pdf_path, start, stop, error) tasks; a file with many pages becomes several tasks.
+    A file that cannot be opened (or has no pages) is one empty task, with the error if any.
+    """
+    for pdf_path in pdf_paths:
+        error = None
+        try:
+            import fitz  # PyMuPDF
+            with fitz.open(pdf_path) as doc:
+                page_count = doc.page_count
+        except Exception as e:
+            error = f"could not open file: {e}"
+            page_count = 0
+        if page_count == 0:
+            yield pdf_path, 0, 0, error
+        for start in range(0, page_count, pages_per_task):
+            yield pdf_path, start, min(start + pages_per_task, page_count), None
+
+
+def iter_page_ranges_parallel(pdf_paths, workers=None, max_memory_mb=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Extracts text from many PDFs with a process pool, fanning out over files and page ranges.
+
+    Yields (pdf_path, first_page_no, page_texts, error) for each page range, files in the order
+    of `pdf_paths` and ranges in page order. `error` is None, or a message when the range (or
+    the whole file) could not be extracted, in which case `page_texts` is empty. `workers`
+    defaults to the CPU count; `max_memory_mb` caps each worker's address space. Only about
+    two tasks per worker are in flight at once, so results never pile up in memory.
+
+    Workers are spawned rather than forked: the caller runs other threads (pipeline stages,
+    upload pools, SQLite connections) and forking a multi-threaded process can deadlock the
+    child. A fresh interpreter also makes the memory cap cover only the worker's own usage.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+    tasks = _page_ranges(pdf_paths, pages_per_task)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_limit_worker_memory, initargs=(max_memory_mb,)) as executor:
+        while True:
+            # Keep the pool busy, but never run further ahead than max_in_flight tasks
+            while len(pending) < max_in_flight:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pdf_path, start, stop, error = task
+                future = executor.submit(_extract_page_range, pdf_path, start, stop) if stop > start else None
+                pending.append((pdf_path, start, stop, future, error))
+            if not pending:
+                break
+
+            pdf_path, start, stop, future, error = pending.popleft()
+            page_texts = []
+            if future is not None:
+                try:
+                    page_texts = future.result()
+                except Exception as e:
+                    # Includes a worker that died outright (e.g. killed at the memory ceiling)
+                    error = f"pages {start}-{stop - 1}: {e}"
+            if error is not None:
+                print(f"Error extracting text from PDF file {pdf_path}: {error}")
+            yield pdf_path, start, page_texts, error
+
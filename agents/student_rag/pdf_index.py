@@ -0,0 +1,85 @@
+# pdf_index.py
+import numpy as np
+
+from chunker import Chunker
+from ingest_manifest import chunk_id
+
+PDF_TOP_K = 5  # PDF chunks added to the prompt per question
+
+
+class PdfChunkIndex:
+    """
+    In-memory vector index over the PDFs uploaded in one Streamlit session.
+
+    Documents are chunked (see chunker.Chunker) and embedded once, when they are uploaded.
+    Each question then adds only its top-k chunks to the prompt instead of every PDF's full
+    text, so prompt size no longer grows with the size or number of uploads. search() returns
+    matches shaped like Pinecone's, so both kinds of results are handled the same way.
+    """
+
+    def __init__(self, embed_texts, chunker_options=None):
+        self._embed_texts = embed_texts  # texts -> vectors (None for failures), e.g. create_vectorsV4.embed_texts
+        self.chunker_options = chunker_options or {}
+        self._documents = {}  # name -> (chunk IDs, chunks, unit-length vectors as a matrix)
+
+    def __len__(self):
+        return sum(len(ids) for ids, _, _ in self._documents.values())
+
+    def prepare(self, pages):
+        """
+        Chunks and embeds an iterable of page texts. Returns (chunks, unit-length vector matrix),
+        leaving out chunks that could not be embedded, or None if nothing is left.
+        """
+        chunker = Chunker(**self.chunker_options)
+        chunks = list(chunker.chunk_pages(enumerate(pages)))
+        vectors = self._embed_texts([chunk['text'] for chunk in chunks])
+        kept = [(chunk, vector) for chunk, vector in zip(chunks, vectors) if vector is not None]
+        if not kept:
+            return None
+        matrix = np.asarray([vector for _, vector in kept], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1)
+        return [chunk for chunk, _ in kept], matrix
+
+    def add_prepared(self, name, chunks, matrix):
+        """
+        Adds a document prepared earlier (possibly by another session). Returns its chunk count.
+        """
+        ids = [chunk_id(name, chunk['text']) for chunk in chunks]
+        self._documents[name] = (ids, chunks, matrix)
+        return len(chunks)
+
+    def clear(self):
+        self._documents.clear()
+
+    def search(self, vector, top_k=PDF_TOP_K):
+        """
+        Returns the `top_k` chunks most similar (cosine) to `vector` across all documents,
+        as {'id', 'score', 'metadata': {'text', 'source', 'page_start', 'page_end'}} dicts.
+        """
+        if not self._documents or top_k <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        candidates = []
+        for name, (ids, chunks, matrix) in self._documents.items():
+            scores = matrix @ query
+            # Only the best top_k of each document can make the overall top_k
+            best = np.argsort(-scores)[:top_k]
+            candidates.extend((float(scores[i]), name, ids[i], chunks[i]) for i in best)
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return [
+            {
+                'id': vector_id,
+                'score': score,
+                'metadata': {
+                    'text': chunk['text'],
+                    'source': name,
+                    'page_start': chunk['page_start'],
+                    'page_end': chunk['page_end'],
+                },
+            }
+            for score, name, vector_id, chunk in candidates[:top_k]
+        ]
@@ -0,0 +1,188 @@
+# rate_limiter.py
+import heapq
+import itertools
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from context_packer import count_tokens
+
+# Priority classes, lower is served first
+INTERACTIVE = 0  # Answers a student is waiting for
+BACKGROUND = 1  # Flashcards and other work nobody is watching
+
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+MIN_RATE_SCALE = 0.1  # Throttling never drops below this fraction of the configured limits
+RATE_RECOVERY_STEP = 0.05  # Fraction of the limits regained per successful call after throttling
+
+
+def _status_code(error):
+    return getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def _retry_after(error):
+    """
+    Seconds from the Retry-After header of a rate limit error, or None.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    value = headers.get('retry-after')
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Process-wide requests/minute and tokens/minute budget for one API, shared by all sessions.
+
+    Both budgets are token buckets holding at most a minute's worth. Callers queue by priority
+    class (then arrival), so interactive answers go before background flashcards. A rate limit
+    error pauses everyone until its Retry-After and halves the refill rate, which then recovers
+    gradually with each success (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.rate_scale = 1.0
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self.calls = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self._queue_waits = {}  # priority -> [count, total seconds, max seconds]
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        scale = self.rate_scale / 60
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute * scale)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute * scale)
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        """
+        Blocks until this caller is first in line and both budgets allow the request.
+        Returns the seconds spent waiting.
+        """
+        tokens = min(tokens, self.tokens_per_minute)  # A huge request waits for a full bucket, not forever
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._waiting[0] == ticket and now >= self._paused_until \
+                        and self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    heapq.heappop(self._waiting)
+                    self._cond.notify_all()
+                    break
+                rate = self.rate_scale / 60
+                delay = max(self._paused_until - now,
+                            (1 - self._requests) / (self.requests_per_minute * rate),
+                            (tokens - self._tokens) / (self.tokens_per_minute * rate),
+                            0.01)
+                self._cond.wait(timeout=delay if self._waiting[0] == ticket else None)
+            waited = time.monotonic() - start
+            stats = self._queue_waits.setdefault(priority, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += waited
+            stats[2] = max(stats[2], waited)
+            self.calls += 1
+        return waited
+
+    def on_success(self):
+        with self._cond:
+            self.rate_scale = min(1.0, self.rate_scale + RATE_RECOVERY_STEP)
+
+    def on_rate_limited(self, retry_after):
+        with self._cond:
+            self.rate_limited += 1
+            self.rate_scale = max(MIN_RATE_SCALE, self.rate_scale / 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
+
+    def call(self, fn, tokens, priority=INTERACTIVE, max_retries=MAX_RETRIES):
+        """
+        Runs fn() within the budgets, retrying rate limit (429) and server (5xx) errors with
+        jittered exponential backoff, or after Retry-After when the error carries one.
+        Returns (result, {'queue_wait_ms', 'retries'}).
+        """
+        waited = 0.0
+        for attempt in range(max_retries + 1):
+            waited += self.acquire(tokens, priority)
+            try:
+                result = fn()
+            except Exception as e:
+                status = _status_code(e)
+                if attempt == max_retries or not (status == 429 or (status and status >= 500)):
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                else:
+                    delay += random.uniform(0, BACKOFF_BASE_SECONDS)  # Keeps sessions from retrying in lockstep
+                with self._cond:
+                    self.retries += 1
+                if status == 429:
+                    self.on_rate_limited(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            self.on_success()
+            return result, {'queue_wait_ms': waited * 1000, 'retries': attempt}
+
+    def stats(self):
+        with self._cond:
+            return {
+                'calls': self.calls,
+                'rate_limited': self.rate_limited,
+                'retries': self.retries,
+                'rate_scale': self.rate_scale,
+                'queued': len(self._waiting),
+                'queue_wait_ms': {
+                    priority: {'avg': total / count * 1000 if count else 0.0, 'max': longest * 1000}
+                    for priority, (count, total, longest) in self._queue_waits.items()
+                },
+            }
+
+
+class RateLimitedClient:
+    """
+    Wraps a Groq (or OpenAI-style) client so that chat.completions.create() goes through a
+    RateLimiter with a fixed priority class. The token cost of a call is estimated as its
+    prompt tokens plus max_tokens. The last call's queue wait and retries are kept per thread.
+    """
+
+    def __init__(self, client, limiter, priority=INTERACTIVE):
+        self._client = client
+        self.limiter = limiter
+        self.priority = priority
+        self._local = threading.local()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        tokens = sum(count_tokens(message['content']) for message in kwargs.get('messages', []))
+        tokens += kwargs.get('max_tokens') or 0
+        result, info = self.limiter.call(lambda: self._client.chat.completions.create(**kwargs),
+                                         tokens, self.priority)
+        self._local.last_call = info
+        return result
+
+    @property
+    def last_call(self):
+        """
+        {'queue_wait_ms', 'retries'} of this thread's most recent call, or None.
+        """
+        return getattr(self._local, 'last_call', None)
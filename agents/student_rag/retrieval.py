@@ -0,0 +1,118 @@
+# retrieval.py
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from ingest_pipeline import percentile
+
+RETRIEVAL_WORKERS_PER_SOURCE = 8  # Calls beyond this queue, for at most the source's deadline
+MAX_LATENCY_SAMPLES = 1000  # Most recent latencies kept per source
+
+# `search` takes the query vector and returns a list of Pinecone-style matches
+RetrievalSource = namedtuple('RetrievalSource', ['name', 'search', 'deadline_seconds'])
+
+
+class SourceStats:
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0  # Never started: all of the source's threads stayed busy until the deadline
+        self.latencies = deque(maxlen=MAX_LATENCY_SAMPLES)  # Seconds, successful calls only
+
+    def as_dict(self):
+        latencies = list(self.latencies)
+        return {
+            'calls': self.calls,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+            },
+        }
+
+
+class Retriever:
+    """
+    Queries every retrieval source concurrently with the same query vector.
+
+    Each source has its own deadline measured from the start of retrieve(). A source that has
+    not answered by then, or that raised, is left out of the result instead of holding up the
+    answer; a call that already started finishes in the background. Each source runs on its own
+    bounded thread pool, so a hung source can never delay the others. When all of a source's
+    threads are busy, a call waits in its queue for at most the source's deadline and is
+    cancelled ('busy') if it has not started by then. Latency, timeout, error and rejection
+    counts are kept per source name. Thread-safe, so one instance can serve every Streamlit session.
+    """
+
+    def __init__(self, max_workers_per_source=RETRIEVAL_WORKERS_PER_SOURCE):
+        self.max_workers_per_source = max_workers_per_source
+        self._pools = {}  # source name -> executor
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, name):
+        with self._lock:
+            if name not in self._pools:
+                self._pools[name] = ThreadPoolExecutor(max_workers=self.max_workers_per_source,
+                                                       thread_name_prefix=f'retrieval-{name}')
+            return self._pools[name]
+
+    def _run(self, source, vector):
+        start = time.perf_counter()
+        matches = source.search(vector)
+        return matches, time.perf_counter() - start
+
+    def retrieve(self, vector, sources):
+        """
+        Returns ({source name: matches}, {source name: report}) where a report has 'status'
+        ('ok', 'timeout', 'error' or 'busy'), 'latency_ms' and 'matches' (how many were returned).
+        Sources that did not answer get an empty match list.
+        """
+        start = time.perf_counter()
+        futures = [(source, self._pool(source.name).submit(self._run, source, vector)) for source in sources]
+        results, reports = {}, {}
+        # Shortest deadline first, so each wait only covers the time left for that source
+        for source, future in sorted(futures, key=lambda item: item[0].deadline_seconds):
+            remaining = source.deadline_seconds - (time.perf_counter() - start)
+            status, latency, matches = 'ok', None, []
+            try:
+                matches, latency = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                # A call still queued for a thread is dropped; one that started is left to finish
+                status = 'busy' if future.cancel() else 'timeout'
+            except Exception as e:
+                status = 'error'
+                print(f"Error querying retrieval source {source.name}: {e}")
+            self._record(source.name, status, latency)
+            results[source.name] = matches
+            reports[source.name] = {
+                'status': status,
+                'latency_ms': (latency if latency is not None else time.perf_counter() - start) * 1000,
+                'matches': len(matches),
+            }
+        return results, reports
+
+    def _record(self, name, status, latency):
+        with self._lock:
+            stats = self._stats.setdefault(name, SourceStats())
+            stats.calls += 1
+            if status == 'timeout':
+                stats.timeouts += 1
+            elif status == 'error':
+                stats.errors += 1
+            elif status == 'busy':
+                stats.rejected += 1
+            else:
+                stats.latencies.append(latency)
+
+    def stats(self):
+        """
+        Cumulative {source name: {calls, timeouts, errors, rejected, latency_ms: {p50, p95, p99}}}.
+        """
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
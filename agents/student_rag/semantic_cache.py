@@ -0,0 +1,138 @@
+# semantic_cache.py
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Caches answers by question meaning rather than exact text.
+
+    An entry stores the question's embedding, the IDs of the context it was answered from,
+    the answer and any flashcards. A new question reuses an entry when it was answered from
+    exactly the same context and its embedding has cosine similarity >= `threshold` with the
+    cached question. Entries are evicted least-recently-used beyond `max_entries` and expire
+    after `ttl_seconds`; invalidate() drops everything, e.g. after the index is re-ingested.
+    Thread-safe, so one instance can be shared by all Streamlit sessions.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=512, ttl_seconds=6 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.index_version = None
+        self._version_seen = False  # None is a valid version too: nothing ingested yet
+        self._by_context = {}  # context key -> {entry_id: entry}
+        self._lru = OrderedDict()  # entry_id -> context key, least recently used first
+        self._ids = count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def context_key(context_ids):
+        return tuple(sorted(set(context_ids)))
+
+    def lookup(self, vector, context_ids):
+        """
+        Returns the best matching entry as a dict (entry_id, query, answer, flashcards, similarity) or None.
+        """
+        key = self.context_key(context_ids)
+        query = self._unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._by_context.get(key, {})
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in list(entries.items()):
+                if entry['expires_at'] <= now:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(query, entry['vector']))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._lru.move_to_end(best_id)
+            entry = entries[best_id]
+            return {'entry_id': best_id, 'query': entry['query'], 'answer': entry['answer'],
+                    'flashcards': list(entry['flashcards']), 'similarity': best_score}
+
+    def store(self, query, vector, context_ids, answer, flashcards=None):
+        """
+        Adds an answer and returns its entry ID, for set_flashcards().
+        """
+        key = self.context_key(context_ids)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._by_context.setdefault(key, {})[entry_id] = {
+                'query': query,
+                'vector': self._unit(vector),
+                'answer': answer,
+                'flashcards': list(flashcards or []),
+                'expires_at': time.monotonic() + self.ttl_seconds,
+            }
+            self._lru[entry_id] = key
+            while len(self._lru) > self.max_entries:
+                self._remove(next(iter(self._lru)))
+            return entry_id
+
+    def set_flashcards(self, entry_id, flashcards):
+        """
+        Attaches flashcards generated after the answer was stored. Ignored if the entry is gone.
+        """
+        with self._lock:
+            key = self._lru.get(entry_id)
+            if key is not None:
+                self._by_context[key][entry_id]['flashcards'] = list(flashcards)
+
+    def _remove(self, entry_id):
+        key = self._lru.pop(entry_id)
+        entries = self._by_context[key]
+        del entries[entry_id]
+        if not entries:
+            del self._by_context[key]
+
+    def invalidate(self):
+        """
+        Drops every cached answer. Call this when the document index has been re-ingested.
+        """
+        with self._lock:
+            self._by_context.clear()
+            self._lru.clear()
+            self.invalidations += 1
+
+    def invalidate_if_changed(self, index_version):
+        """
+        Invalidates the cache when `index_version` differs from the one seen last time,
+        including a first ingest after starting without one (None -> version).
+        """
+        with self._lock:
+            changed = self._version_seen and index_version != self.index_version
+            self.index_version = index_version
+            self._version_seen = True
+        if changed:
+            self.invalidate()
+        return changed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._lru),
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,78 @@
+# single_flight.py
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.interrupted = False  # The leader was stopped by something other than an Exception
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function and
+    every caller that arrives while it is running waits for it and gets the same result
+    (or the same exception). Nothing is cached once the call has finished.
+
+    Only Exceptions are shared. If the leader is interrupted by a BaseException (e.g. a
+    Streamlit rerun or stop of the leader's own session), that stays with the leader and
+    the waiting callers start over, one of them running the function.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}  # key -> _Call
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Returns (result, shared) where `shared` is True if the result came from another caller's call.
+        """
+        with self._lock:
+            self.calls += 1
+        while True:
+            with self._lock:
+                call = self._in_flight.get(key)
+                if call is not None:
+                    leader = False
+                else:
+                    call = _Call()
+                    self._in_flight[key] = call
+                    leader = True
+
+            if leader:
+                break
+            call.done.wait()
+            if call.interrupted:
+                continue
+            with self._lock:
+                self.coalesced += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.interrupted = True
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'coalesced_rate': self.coalesced / self.calls if self.calls else 0.0,
+                'in_flight': len(self._in_flight),
+            }
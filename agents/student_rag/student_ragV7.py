@@ -1,21 +1,199 @@
 from groq import Groq
-from create_vectorsV4 import pinecone_client, vector_index, embed_text, extract_text_from_uploaded_pdf
+from create_vectorsV4 import search_index, warm_up, embed_query, embed_texts, iter_uploaded_pdf_pages, query_embedding_cache, index_version, EMBEDDING_MODEL, EMBEDDING_DIM
+from semantic_cache import SemanticCache
+from pdf_index import PdfChunkIndex
+from upload_cache import UploadCache, content_key
+from retrieval import Retriever, RetrievalSource
+from context_packer import Passage, pack_context, count_tokens, CONTEXT_TOKEN_BUDGET
+from timing import RequestTimer, StageLatencies
+from rate_limiter import RateLimiter, RateLimitedClient, INTERACTIVE, BACKGROUND
+from single_flight import SingleFlight
+from query_cache import normalize_query
+from flashcards import FlashcardWorker, generate_answer_flashcards, answer_key, merge_flashcards, MIN_ANSWER_CHARS
 import streamlit as st
 import os
 import json
 import re
+import threading
+import time
 from dotenv import load_dotenv
 from datetime import datetime
+from uuid import uuid4
 
 load_dotenv()
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Retries are left to the shared rate limiter below, which knows about every session's calls
+groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+
+GROQ_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+GROQ_TOKENS_PER_MINUTE = int(os.getenv("GROQ_TOKENS_PER_MINUTE", "6000"))
+
+@st.cache_resource
+def get_groq_limiter():
+    """
+    One Groq request/token budget for the whole server process, shared by every session.
+    """
+    return RateLimiter(GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE)
+
+groq_limiter = get_groq_limiter()
+# Answers are served before flashcards when the budget is tight
+answer_client = RateLimitedClient(groq_client, groq_limiter, INTERACTIVE)
+flashcard_client = RateLimitedClient(groq_client, groq_limiter, BACKGROUND)
+
+@st.cache_resource
+def start_warm_up():
+    """
+    Once per server process: builds the Gemini and Pinecone clients and opens the index
+    connection in the background, so the first question does not pay for it.
+    """
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+start_warm_up()
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(6 * 3600)))
+
+@st.cache_resource
+def get_answer_cache():
+    """
+    One semantic answer cache shared by every session of this server.
+    """
+    return SemanticCache(threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                         ttl_seconds=ANSWER_CACHE_TTL_SECONDS)
+
+answer_cache = get_answer_cache()
+
+UPLOAD_CACHE_DIR = os.getenv(
+    "UPLOAD_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "uploads")
+)
+
+@st.cache_resource
+def get_upload_cache():
+    """
+    Chunks and embeddings of uploaded PDFs by content hash, shared by every session,
+    so a file any student already uploaded is not extracted or embedded again.
+    """
+    return UploadCache(UPLOAD_CACHE_DIR)
+
+upload_cache = get_upload_cache()
+
+# Retrieval sources are queried concurrently; one that misses its deadline is left out of the answer
+# Candidates fetched per source; the context packer keeps as many as relevance and the token budget allow
+RETRIEVAL_TOP_K = 10
+PINECONE_DEADLINE_SECONDS = float(os.getenv("PINECONE_DEADLINE_SECONDS", "2.0"))
+PDF_DEADLINE_SECONDS = float(os.getenv("PDF_DEADLINE_SECONDS", "1.0"))
+
+@st.cache_resource
+def get_retriever():
+    """
+    Per-source retrieval thread pools (and their statistics) shared by every session.
+    """
+    return Retriever()
+
+retriever = get_retriever()
+
+@st.cache_resource
+def get_flashcard_worker():
+    """
+    One background flashcard thread pool shared by every session.
+    """
+    return FlashcardWorker()
+
+flashcard_worker = get_flashcard_worker()
+
+@st.cache_resource
+def get_single_flight():
+    """
+    Coalesces identical questions asked at the same time by different sessions.
+    """
+    return SingleFlight()
+
+single_flight = get_single_flight()
+
+QUERY_METRICS_PATH = os.getenv(
+    "QUERY_METRICS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "query_latency.jsonl")
+)
+
+@st.cache_resource
+def get_stage_latencies():
+    """
+    Rolling per-stage latency percentiles of all sessions, exported as JSON lines to QUERY_METRICS_PATH.
+    """
+    return StageLatencies(QUERY_METRICS_PATH)
+
+stage_latencies = get_stage_latencies()
+
+def answer_flashcards_job(query, answer, cache_entry_id):
+    """
+    Runs on the flashcard worker: generates the cards for an answer and adds them to its answer cache entry.
+    Sessions that got the same answer share one job (see submit_answer_flashcards).
+    """
+    start = time.perf_counter()
+    flashcards = generate_answer_flashcards(flashcard_client, query, answer)
+    stage_latencies.record('flashcards', (time.perf_counter() - start) * 1000)
+    answer_cache.set_flashcards(cache_entry_id, flashcards)
+    return flashcards
+
+def submit_answer_flashcards(query, answer, cache_entry_id):
+    """
+    Makes the cards for an answer this session's background flashcard job, joining the job of
+    any other session that got the same answer instead of generating them again.
+    """
+    flashcard_worker.submit_shared(st.session_state.session_id, ('flashcards', answer_key(answer)),
+                                   answer_flashcards_job, query, answer, cache_entry_id)
+
+def retrieval_sources(pdf_index):
+    """
+    The sources searched for every question: the Pinecone index and this session's uploaded PDFs.
+    """
+    def search_pinecone(vector):
+        # Pinecone returns IDs and small metadata; the chunk texts (and, in two-stage mode,
+        # the full vectors used for rescoring) are read locally
+        return search_index(vector, RETRIEVAL_TOP_K)
+
+    sources = [RetrievalSource('pinecone', search_pinecone, PINECONE_DEADLINE_SECONDS)]
+    if len(pdf_index):
+        sources.append(RetrievalSource(
+            'pdf', lambda vector: pdf_index.search(vector, top_k=RETRIEVAL_TOP_K), PDF_DEADLINE_SECONDS))
+    return sources
+
+def stream_completion(timing, **kwargs):
+    """
+    Yields the text of a streamed Groq chat completion as it arrives. Fills `timing` with
+    'ttft_ms' (time to the first token) and 'total_ms' (until the stream ended).
+    """
+    start = time.perf_counter()
+    for chunk in answer_client.chat.completions.create(stream=True, **kwargs):
+        # Groq reports token usage on the last chunk
+        usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+        if usage is not None:
+            timing['prompt_tokens'] = usage.prompt_tokens
+            timing['completion_tokens'] = usage.completion_tokens
+        if not chunk.choices:
+            continue
+        token = chunk.choices[0].delta.content
+        if token:
+            if 'ttft_ms' not in timing:
+                timing['ttft_ms'] = (time.perf_counter() - start) * 1000
+            yield token
+    timing['total_ms'] = (time.perf_counter() - start) * 1000
 
 # --- Session State Initialization ---
+if "session_id" not in st.session_state:
+    # Identifies this session's background flashcard job
+    st.session_state.session_id = str(uuid4())
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
 if "flashcards" not in st.session_state:
     st.session_state.flashcards = []
+if "answer_flashcards" not in st.session_state:
+    # Per-answer flashcard extracts (answer_key -> cards), merged into the overall deck
+    st.session_state.answer_flashcards = {}
 if "current_flashcard_index" not in st.session_state:
     st.session_state.current_flashcard_index = 0
 if "show_flashcards" not in st.session_state:
@@ -25,11 +203,33 @@ if "last_query" not in st.session_state:
     st.session_state.last_query = ""
 if "last_answer" not in st.session_state:
     st.session_state.last_answer = ""
+if "last_query_cache_hit" not in st.session_state:
+    st.session_state.last_query_cache_hit = False
+if "last_answer_cached" not in st.session_state:
+    st.session_state.last_answer_cached = False
+if "last_retrieval" not in st.session_state:
+    st.session_state.last_retrieval = {}
+if "last_llm_timing" not in st.session_state:
+    st.session_state.last_llm_timing = {}
+if "last_context_report" not in st.session_state:
+    st.session_state.last_context_report = {}
+if "last_timings" not in st.session_state:
+    st.session_state.last_timings = {}
+if "last_request_coalesced" not in st.session_state:
+    st.session_state.last_request_coalesced = False
 
 if "uploaded_pdfs" not in st.session_state:
     st.session_state.uploaded_pdfs = []
-if "pdf_texts" not in st.session_state:
-    st.session_state.pdf_texts = {}
+if "pdf_index" not in st.session_state:
+    # Chunks and embeddings of the uploaded PDFs, searched per question
+    st.session_state.pdf_index = PdfChunkIndex(embed_texts)
+
+if "pdf_hashes" not in st.session_state:
+    # Content hash of every PDF in pdf_index, by its (unique) name there
+    st.session_state.pdf_hashes = {}
+if "seen_uploads" not in st.session_state:
+    # file_id of every upload already handled, so files are hashed once and not on every rerun
+    st.session_state.seen_uploads = set()
 
 if "pdf_upload_key" not in st.session_state:
     st.session_state.pdf_upload_key = "initial_key"
@@ -53,24 +253,46 @@ with st.sidebar:
 
     if uploaded_files:
         for uploaded_pdf in uploaded_files:
-            if uploaded_pdf.name not in [pdf.name for pdf in st.session_state.uploaded_pdfs]:
-                st.session_state.uploaded_pdfs.append(uploaded_pdf)
-                with st.spinner(f"Extracting text from {uploaded_pdf.name}..."):
-                    pdf_text = extract_text_from_uploaded_pdf(uploaded_pdf)
-                    if pdf_text:
-                        st.session_state.pdf_texts[uploaded_pdf.name] = pdf_text
-                        st.success(f"✅ PDF '{uploaded_pdf.name}' uploaded and text extracted!")
-                    else:
-                        st.session_state.uploaded_pdfs.pop()
-                        st.error(f"❌ Failed to extract text from {uploaded_pdf.name}. Please try another file.")
+            if uploaded_pdf.file_id in st.session_state.seen_uploads:
+                continue
+            st.session_state.seen_uploads.add(uploaded_pdf.file_id)
+            # Duplicates are found by content, whatever the files are called
+            pdf_key = content_key(uploaded_pdf.getvalue(), st.session_state.pdf_index.chunker_options,
+                                  EMBEDDING_MODEL, EMBEDDING_DIM)
+            duplicate_of = [name for name, key in st.session_state.pdf_hashes.items() if key == pdf_key]
+            if duplicate_of:
+                st.info(f"'{uploaded_pdf.name}' has the same content as '{duplicate_of[0]}', skipping it.")
+                continue
+            # A different file with a name already in use is indexed under a numbered name
+            index_name = uploaded_pdf.name
+            stem, extension = os.path.splitext(uploaded_pdf.name)
+            copy_no = 2
+            while index_name in st.session_state.pdf_hashes:
+                index_name = f"{stem} ({copy_no}){extension}"
+                copy_no += 1
+            with st.spinner(f"Extracting and indexing text from {uploaded_pdf.name}..."):
+                prepared = upload_cache.get(pdf_key)
+                if prepared is None:
+                    prepared = st.session_state.pdf_index.prepare(iter_uploaded_pdf_pages(uploaded_pdf))
+                    if prepared is not None:
+                        upload_cache.put(pdf_key, *prepared)
+                chunk_count = st.session_state.pdf_index.add_prepared(index_name, *prepared) if prepared else 0
+                if chunk_count:
+                    st.session_state.pdf_hashes[index_name] = pdf_key
+                    st.session_state.uploaded_pdfs.append(uploaded_pdf)
+                    st.success(f"✅ PDF '{index_name}' uploaded and indexed ({chunk_count} chunks)!")
+                else:
+                    st.error(f"❌ Failed to extract text from {uploaded_pdf.name}. Please try another file.")
 
     if st.session_state.uploaded_pdfs:
         st.write("**Loaded PDFs:**")
-        for pdf in st.session_state.uploaded_pdfs:
-            st.markdown(f"- {pdf.name}")
+        for name in st.session_state.pdf_hashes:
+            st.markdown(f"- {name}")
         if st.button("🗑️ Clear All PDFs"):
             st.session_state.uploaded_pdfs = []
-            st.session_state.pdf_texts = {}
+            st.session_state.pdf_index.clear()
+            st.session_state.pdf_hashes = {}
+            st.session_state.seen_uploads = set()
             st.session_state.pdf_upload_key = str(datetime.now())
             st.rerun()
 
@@ -91,7 +313,7 @@ with st.sidebar:
                 Flashcards (JSON format):
                 """
                 try:
-                    flashcard_response = groq_client.chat.completions.create(
+                    flashcard_response = flashcard_client.chat.completions.create(
                         model="llama3-70b-8192",
                         messages=[
                             {"role": "system", "content": "You are a flashcard creator. Create educational flashcards in JSON format."},
@@ -114,44 +336,38 @@ with st.sidebar:
 
     # NEW: Generate overall flashcards for all previous LLM answers
     if st.button("📝 Generate Overall Flashcards from Conversation"):
-        # Collect all LLM answers from chat_history
-        llm_answers = [msg["content"] for msg in st.session_state.chat_history if msg["role"] == "bot"]
-        combined_text = "\n\n".join(llm_answers).strip()
+        # Pair every LLM answer in chat_history with the question it answers
+        qa_pairs = []
+        question = ""
+        for msg in st.session_state.chat_history:
+            if msg["role"] == "user":
+                question = msg["content"]
+            else:
+                qa_pairs.append((question, msg["content"]))
+        combined_length = sum(len(answer) for _, answer in qa_pairs)
 
-        if len(combined_text) < 500:
+        if combined_length < 500:
             st.warning("⚠️ The combined conversation answers are too short to generate overall flashcards.", icon="⚠️")
         else:
             with st.spinner("Creating overall flashcards from entire conversation..."):
-                overall_flashcard_prompt = f"""
-                Based on the following conversation answers, create 5-10 educational flashcards.
-                Each flashcard should have a clear concept on the front and detailed explanation on the back.
-                Format as a JSON array of objects with 'front' and 'back' keys.
-                Conversation Answers:
-                {combined_text}
-                Flashcards (JSON format):
-                """
-                try:
-                    flashcard_response = groq_client.chat.completions.create(
-                        model="llama3-70b-8192",
-                        messages=[
-                            {"role": "system", "content": "You are a flashcard creator. Create educational flashcards in JSON format."},
-                            {"role": "user", "content": overall_flashcard_prompt}
-                        ],
-                        temperature=0.3,
-                        max_tokens=1500
-                    )
-                    flashcard_text = flashcard_response.choices[0].message.content.strip()
-                    json_match = re.search(r'\[[\s\S]*\]', flashcard_text)
-                    if json_match:
-                        flashcards = json.loads(json_match.group())
-                        st.session_state.flashcards = flashcards
-                        st.session_state.current_flashcard_index = 0
-                        st.session_state.show_flashcards = True
-                        st.success(f"✅ Generated {len(flashcards)} overall flashcards from conversation!")
-                    else:
-                        st.error("Could not parse overall flashcards. Try again.")
-                except Exception as e:
-                    st.error(f"Error generating overall flashcards: {str(e)}")
+                # Map: only answers without a flashcard extract yet cost an LLM call
+                missing = list({answer_key(answer): (question, answer) for question, answer in qa_pairs
+                                if answer_key(answer) not in st.session_state.answer_flashcards}.values())
+                for (question, answer), flashcards in zip(
+                        missing, flashcard_worker.map(lambda q, a: generate_answer_flashcards(flashcard_client, q, a), missing)):
+                    if flashcards:
+                        st.session_state.answer_flashcards[answer_key(answer)] = flashcards
+                # Reduce: merge the extracts locally, dropping duplicate cards
+                flashcards = merge_flashcards(st.session_state.answer_flashcards.get(answer_key(answer), [])
+                                              for _, answer in qa_pairs)
+                if flashcards:
+                    st.session_state.flashcards = flashcards
+                    st.session_state.current_flashcard_index = 0
+                    st.session_state.show_flashcards = True
+                    st.success(f"✅ Generated {len(flashcards)} overall flashcards from conversation "
+                               f"({len(missing)} new answer(s) processed)!")
+                else:
+                    st.error("Could not create overall flashcards. Try again.")
 
     if st.session_state.flashcards:
         flashcard_json = json.dumps(st.session_state.flashcards, indent=2)
@@ -164,16 +380,89 @@ with st.sidebar:
 
     st.markdown("---")
     st.subheader("⚙️ Advanced Options")
+    st.checkbox("Stream answers", value=True, key="stream_answers",
+                help="Show the answer token by token while it is being generated.")
+    st.checkbox("Bypass answer cache", key="bypass_answer_cache",
+                help="Always ask the LLM, even if a similar question was answered from the same context.")
     if st.button("📊 View Search Context"):
         with st.expander("Search Context Details"):
             st.write("**Last Query:**", st.session_state.last_query)
             st.write("**Last Answer Length:**", len(st.session_state.last_answer))
             st.write("**Flashcards Count:**", len(st.session_state.flashcards))
             st.write("**PDFs Loaded:**", len(st.session_state.uploaded_pdfs))
+            st.write("**Last Request:**", "shared with an identical in-flight question"
+                     if st.session_state.last_request_coalesced else "computed for this session")
+            flight_stats = single_flight.stats()
+            st.write("**Request Coalescing:**",
+                     f"{flight_stats['coalesced']} of {flight_stats['calls']} requests coalesced "
+                     f"({flight_stats['coalesced_rate']:.0%})")
+            st.write("**Last Query Embedding:**", "cached" if st.session_state.last_query_cache_hit else "computed")
+            cache_stats = query_embedding_cache.stats()
+            st.write("**Query Embedding Cache:**",
+                     f"{cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                     f"({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']} entries)")
+            st.write("**Last Answer:**", "from answer cache" if st.session_state.last_answer_cached else "generated")
+            answer_stats = answer_cache.stats()
+            st.write("**Answer Cache:**",
+                     f"{answer_stats['hits']} hits / {answer_stats['misses']} misses "
+                     f"({answer_stats['hit_rate']:.0%} hit rate, {answer_stats['entries']} entries, "
+                     f"{answer_stats['invalidations']} invalidations)")
+            timings = st.session_state.last_timings
+            if timings:
+                st.write("**Last Request Timings:**", f"{timings['total_ms']:.0f} ms in total")
+                for stage_name, milliseconds in timings['spans_ms'].items():
+                    st.write(f"- {stage_name}: {milliseconds:.0f} ms")
+                st.write("**Last Request Counters:**",
+                         ", ".join(f"{name} {value}" for name, value in timings['counters'].items()))
+            st.write("**Stage Latency (all sessions):**")
+            for stage_name, latency in stage_latencies.snapshot().items():
+                st.write(f"- {stage_name}: p50 {latency['p50_ms']:.0f} / p95 {latency['p95_ms']:.0f} / "
+                         f"p99 {latency['p99_ms']:.0f} ms over {latency['count']} calls")
+            limiter_stats = groq_limiter.stats()
+            queue_waits = limiter_stats['queue_wait_ms']
+            st.write("**Groq Rate Limiter:**",
+                     f"{limiter_stats['calls']} calls, {limiter_stats['rate_limited']} rate limited, "
+                     f"{limiter_stats['retries']} retries, {limiter_stats['queued']} queued, "
+                     f"running at {limiter_stats['rate_scale']:.0%} of the configured limits")
+            for priority, label in ((INTERACTIVE, "answers"), (BACKGROUND, "flashcards")):
+                if priority in queue_waits:
+                    st.write(f"- {label}: queue wait avg {queue_waits[priority]['avg']:.0f} ms, "
+                             f"max {queue_waits[priority]['max']:.0f} ms")
+            llm_timing = st.session_state.last_llm_timing
+            if llm_timing:
+                st.write("**Last LLM Call:**",
+                         f"first token after {llm_timing.get('ttft_ms', 0):.0f} ms, "
+                         f"complete after {llm_timing.get('total_ms', 0):.0f} ms "
+                         f"({'streamed' if llm_timing.get('streamed') else 'not streamed'})")
+            context_report = st.session_state.last_context_report
+            if context_report:
+                st.write("**Last Prompt Context:**",
+                         f"~{context_report['tokens']} of {context_report['budget_tokens']} tokens "
+                         f"(estimated with {context_report['tokenizer']}), {len(context_report['ids'])} of "
+                         f"{context_report['candidates']} passages; dropped {context_report['cut_by_score']} "
+                         f"after a score drop, {context_report['duplicates']} duplicates, "
+                         f"{context_report['over_budget']} over budget")
+                for source_name, usage in context_report['per_source'].items():
+                    st.write(f"- {source_name}: {usage['passages']} passages, ~{usage['tokens']} tokens")
+            upload_stats = upload_cache.stats()
+            st.write("**Upload Cache:**",
+                     f"{upload_stats['memory_hits']} memory hits / {upload_stats['disk_hits']} disk hits / "
+                     f"{upload_stats['misses']} misses ({upload_stats['memory_entries']} in memory)")
+            st.write("**Last Retrieval:**")
+            for source_name, report in st.session_state.last_retrieval.items():
+                st.write(f"- {source_name}: {report['status']}, {report['latency_ms']:.0f} ms, "
+                         f"{report['matches']} matches")
+            st.write("**Retrieval Sources (all sessions):**")
+            for source_name, source_stats in retriever.stats().items():
+                latency = source_stats['latency_ms']
+                st.write(f"- {source_name}: {source_stats['calls']} calls, {source_stats['timeouts']} timeouts, "
+                         f"{source_stats['errors']} errors, {source_stats['rejected']} busy, "
+                         f"p50 {latency['p50']:.0f} ms / p95 {latency['p95']:.0f} ms")
 
     if st.button("🗑️ Clear Entire Chat History"):
         st.session_state.chat_history = []
         st.session_state.flashcards = []
+        st.session_state.answer_flashcards = {}
         st.session_state.current_flashcard_index = 0
         st.session_state.show_flashcards = False
         st.session_state.last_query = ""
@@ -248,6 +537,26 @@ with chat_container:
                 st.session_state.show_flashcards = False
                 st.rerun()
 
+# --- Background Flashcards ---
+@st.fragment(run_every=1.0 if flashcard_worker.pending(st.session_state.session_id) else None)
+def poll_flashcards():
+    """
+    Re-runs every second while this session's flashcards are being generated and shows them once ready.
+    """
+    finished, flashcards = flashcard_worker.result(st.session_state.session_id)
+    if finished:
+        if flashcards:
+            # The job belongs to the last answer; an older one would have been cancelled
+            # Sessions that shared the generation got the same list, so each keeps its own copy
+            st.session_state.answer_flashcards[answer_key(st.session_state.last_answer)] = list(flashcards)
+            st.session_state.flashcards = list(flashcards)
+            st.session_state.current_flashcard_index = 0
+        st.rerun()
+    elif flashcard_worker.pending(st.session_state.session_id):
+        st.caption("📚 Creating flashcards...")
+
+poll_flashcards()
+
 # --- Flashcard Toggle ---
 if st.session_state.flashcards:
     toggle_label = "📖 Hide Flashcards" if st.session_state.show_flashcards else "📖 Show Flashcards"
@@ -273,84 +582,161 @@ with st.form(key='query_form', clear_on_submit=True):
     user_query = st.text_input("Enter your query:", placeholder="Ask me something...", label_visibility='collapsed')
     submit_button = st.form_submit_button("🔍 Submit")
 
+def answer_question(query, pdf_index, bypass_cache, stream):
+    """
+    Embeds the question, retrieves and packs context, and answers it from the answer cache or the LLM.
+    Streams the answer into the conversation if `stream` is set. Returns a dict describing the
+    result, or None if the question could not be embedded. Touches no session state, so the
+    result can be shared with other sessions asking the same question.
+    """
+    timer = RequestTimer()
+    with timer.span('embed'):
+        vector, query_cache_hit = embed_query(query)
+    timer.count('query_embedding_cached', query_cache_hit)
+    if vector is None:
+        return None
+    with timer.span('retrieve'):
+        matches, retrieval_report = retriever.retrieve(vector, retrieval_sources(pdf_index))
+
+    # Only the PDF chunks closest to the question, not the whole PDFs
+    passages = []
+    for match in matches.get('pdf', []):
+        metadata = match['metadata']
+        passages.append(Passage(
+            match['id'], 'pdf', match['score'],
+            f"Relevant PDF Content from '{metadata['source']}' "
+            f"(pages {metadata['page_start'] + 1}-{metadata['page_end'] + 1}):",
+            metadata['text']))
+    for match in matches['pinecone']:
+        passages.append(Passage(match['id'], 'pinecone', match['score'],
+                                'Document Database Context:', match['metadata']['text']))
+
+    with timer.span('pack_context'):
+        combined_context, context_report = pack_context(passages, budget_tokens=CONTEXT_TOKEN_BUDGET)
+    timer.count('context_tokens', context_report['tokens'])
+    # Identifies everything the answer is based on, for the answer cache
+    context_ids = context_report['ids']
+    if not combined_context:
+        combined_context = "No specific context found in PDFs or document database."
+
+    result = {
+        'vector': vector,
+        'query_cache_hit': query_cache_hit,
+        'retrieval': retrieval_report,
+        'context_report': context_report,
+        'cached': None,
+        'llm_timing': {},
+        'cache_entry_id': None,
+        'timings': None,
+    }
+    with timer.span('answer_cache'):
+        answer_cache.invalidate_if_changed(index_version())
+        if not bypass_cache:
+            result['cached'] = answer_cache.lookup(vector, context_ids)
+    timer.count('answer_cached', result['cached'] is not None)
+    if result['cached'] is not None:
+        result['answer'] = result['cached']['answer']
+        stage_latencies.record_request(timer)
+        result['timings'] = timer.as_dict()
+        return result
+
+    user_context = {
+        'role': 'user',
+        'content': f'Context:\n{combined_context}\n\nQuestion: {query}'
+    }
+    completion_options = {
+        'model': "llama3-70b-8192",
+        'messages': [system_context, user_context],
+        'temperature': 0.7,
+        'max_tokens': 512
+    }
+    llm_timing = {'streamed': stream}
+    llm_start = time.perf_counter()
+    if stream:
+        # Render into the conversation as tokens arrive instead of after st.rerun()
+        with chat_container:
+            with st.chat_message("user"):
+                st.markdown(query)
+            with st.chat_message("assistant"):
+                llm_answer = st.write_stream(stream_completion(llm_timing, **completion_options))
+        llm_answer = llm_answer.strip()
+    else:
+        start = time.perf_counter()
+        llm_response = answer_client.chat.completions.create(**completion_options)
+        llm_answer = llm_response.choices[0].message.content.strip()
+        llm_timing['ttft_ms'] = llm_timing['total_ms'] = (time.perf_counter() - start) * 1000
+        usage = getattr(llm_response, 'usage', None)
+        if usage is not None:
+            llm_timing['prompt_tokens'] = usage.prompt_tokens
+            llm_timing['completion_tokens'] = usage.completion_tokens
+    timer.add('llm', time.perf_counter() - llm_start)
+    # Part of the llm span: time queued for the shared Groq budget, including retry backoff
+    timer.add('llm_queue_wait', answer_client.last_call['queue_wait_ms'] / 1000)
+    timer.count('llm_retries', answer_client.last_call['retries'])
+    timer.add('llm_first_token', llm_timing.get('ttft_ms', 0) / 1000)
+    # Token counts from Groq when it reports them, otherwise estimated
+    timer.count('prompt_tokens', llm_timing.get('prompt_tokens') or
+                count_tokens(system_prompt) + count_tokens(user_context['content']))
+    timer.count('completion_tokens', llm_timing.get('completion_tokens') or count_tokens(llm_answer))
+    result['answer'] = llm_answer
+    result['llm_timing'] = llm_timing
+    result['cache_entry_id'] = answer_cache.store(query, vector, context_ids, llm_answer)
+    stage_latencies.record_request(timer)
+    result['timings'] = timer.as_dict()
+    return result
+
 if submit_button and user_query:
     query_to_process = user_query.strip()
     if query_to_process:
         st.session_state.last_query = query_to_process
         st.session_state.chat_history.append({"role": "user", "content": query_to_process})
+        # Flashcards still being made for the previous answer are no longer wanted
+        flashcard_worker.cancel(st.session_state.session_id)
 
         with st.spinner("🔍 Searching context (PDF & Documents) and generating response..."):
             try:
-                vector = embed_text(query_to_process)
-                if vector is None:
+                # Sessions asking the same question with the same retrieval setup share one computation
+                pdf_index = st.session_state.pdf_index
+                flight_key = (normalize_query(query_to_process), RETRIEVAL_TOP_K, CONTEXT_TOKEN_BUDGET,
+                              index_version(), frozenset(st.session_state.pdf_hashes.values()),
+                              st.session_state.bypass_answer_cache)
+                bypass_cache, stream = st.session_state.bypass_answer_cache, st.session_state.stream_answers
+                result, st.session_state.last_request_coalesced = single_flight.do(
+                    flight_key, lambda: answer_question(query_to_process, pdf_index, bypass_cache, stream))
+                if result is None:
                     st.error("Failed to embed the query.")
                     st.session_state.chat_history.pop()
                 else:
-                    combined_context_parts = []
-
-                    for pdf_name, pdf_text in st.session_state.pdf_texts.items():
-                        combined_context_parts.append(f"Relevant PDF Content from '{pdf_name}':\n{pdf_text}")
-
-                    query_response = vector_index.query(vector=vector, top_k=5, include_metadata=True)
-                    similar_docs = ''
-                    for match in query_response['matches']:
-                        text = match['metadata']['text']
-                        similar_docs += 'Document Context: ' + text[:200] + '...\n'
-                    if similar_docs:
-                        combined_context_parts.append(f"Document Database Context:\n{similar_docs}")
-
-                    combined_context = "\n\n".join(combined_context_parts)
-                    if not combined_context:
-                        combined_context = "No specific context found in PDFs or document database."
-
-                    user_context = {
-                        'role': 'user',
-                        'content': f'Context:\n{combined_context}\n\nQuestion: {query_to_process}'
-                    }
-
-                    llm_response = groq_client.chat.completions.create(
-                        model="llama3-70b-8192",
-                        messages=[system_context, user_context],
-                        temperature=0.7,
-                        max_tokens=512
-                    )
-                    llm_answer = llm_response.choices[0].message.content.strip()
+                    llm_answer = result['answer']
+                    cached = result['cached']
+                    st.session_state.last_query_cache_hit = result['query_cache_hit']
+                    st.session_state.last_retrieval = result['retrieval']
+                    st.session_state.last_context_report = result['context_report']
+                    st.session_state.last_timings = result['timings']
+                    st.session_state.last_answer_cached = cached is not None
                     st.session_state.last_answer = llm_answer
                     st.session_state.chat_history.append({"role": "bot", "content": llm_answer})
-
-                    # AUTO-GENERATE FLASHCARDS ONLY IF ANSWER IS LONG ENOUGH
-                    if len(llm_answer.strip()) >= 500:
-                        with st.spinner("📚 Creating flashcards..."):
-                            flashcard_prompt = f"""
-                            Based on the question and answer, create 2-3 educational flashcards.
-                            Format: [{{"front": "...", "back": "..."}}]
-                            Question: {query_to_process}
-                            Answer: {llm_answer}
-                            Flashcards:
-                            """
-                            try:
-                                flashcard_response = groq_client.chat.completions.create(
-                                    model="llama3-70b-8192",
-                                    messages=[
-                                        {"role": "system", "content": "Flashcard creator. JSON only."},
-                                        {"role": "user", "content": flashcard_prompt}
-                                    ],
-                                    temperature=0.3,
-                                    max_tokens=800
-                                )
-                                flashcard_text = flashcard_response.choices[0].message.content.strip()
-                                json_match = re.search(r'\[[\s\S]*\]', flashcard_text)
-                                if json_match:
-                                    flashcards = json.loads(json_match.group())
-                                    st.session_state.flashcards = flashcards
-                                    st.session_state.current_flashcard_index = 0
-                            except Exception:
-                                pass
+                    st.session_state.current_flashcard_index = 0
+
+                    if cached is not None:
+                        # The result may be shared with coalesced sessions; Shuffle reorders the deck in place
+                        st.session_state.flashcards = list(cached['flashcards'])
+                        if cached['flashcards']:
+                            st.session_state.answer_flashcards[answer_key(llm_answer)] = list(cached['flashcards'])
+                        elif len(llm_answer.strip()) >= MIN_ANSWER_CHARS:
+                            # The entry's cards are still being made (joins that job) or failed (retries them)
+                            submit_answer_flashcards(cached['query'], llm_answer, cached['entry_id'])
+                        else:
+                            st.session_state.show_flashcards = False
                     else:
-                        # Clear flashcards if answer too short
+                        st.session_state.last_llm_timing = result['llm_timing']
+                        # AUTO-GENERATE FLASHCARDS ONLY IF ANSWER IS LONG ENOUGH, in the background
                         st.session_state.flashcards = []
-                        st.session_state.current_flashcard_index = 0
-                        st.session_state.show_flashcards = False
+                        if len(llm_answer.strip()) >= MIN_ANSWER_CHARS:
+                            submit_answer_flashcards(query_to_process, llm_answer, result['cache_entry_id'])
+                        else:
+                            # Clear flashcards if answer too short
+                            st.session_state.show_flashcards = False
 
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
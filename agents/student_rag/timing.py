@@ -0,0 +1,119 @@
+# timing.py
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from ingest_pipeline import percentile
+
+MAX_STAGE_SAMPLES = 1000  # Most recent durations kept per stage for the rolling percentiles
+EXPORT_EVERY_SECONDS = 60
+
+
+class RequestTimer:
+    """
+    Collects the duration of each stage of one request, plus any counters (tokens, cache hits).
+
+        timer = RequestTimer()
+        with timer.span('embed'):
+            ...
+        timer.count('prompt_tokens', 812)
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}  # stage -> milliseconds, summed if a stage runs more than once
+        self.counters = {}
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds * 1000
+
+    def count(self, name, value):
+        self.counters[name] = value
+
+    def as_dict(self):
+        return {
+            'total_ms': (time.perf_counter() - self.started) * 1000,
+            'spans_ms': dict(self.spans),
+            'counters': dict(self.counters),
+        }
+
+
+class StageLatencies:
+    """
+    Process-wide rolling latency percentiles per stage, fed with finished RequestTimers or
+    single durations. Every `export_every_seconds` (checked on record) a snapshot with the
+    p50/p95/p99 of each stage is appended to `export_path` as one JSON line, for scraping.
+    """
+
+    def __init__(self, export_path=None, export_every_seconds=EXPORT_EVERY_SECONDS):
+        self.export_path = export_path
+        self.export_every_seconds = export_every_seconds
+        self._samples = {}  # stage -> deque of milliseconds
+        self._counts = {}
+        self._last_export = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, name, milliseconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=MAX_STAGE_SAMPLES)).append(milliseconds)
+            self._counts[name] = self._counts.get(name, 0) + 1
+        self._maybe_export()
+
+    def record_request(self, timer):
+        timings = timer.as_dict()
+        with self._lock:
+            for name, milliseconds in list(timings['spans_ms'].items()) + [('request', timings['total_ms'])]:
+                self._samples.setdefault(name, deque(maxlen=MAX_STAGE_SAMPLES)).append(milliseconds)
+                self._counts[name] = self._counts.get(name, 0) + 1
+        self._maybe_export()
+
+    def snapshot(self):
+        """
+        {stage: {count, p50_ms, p95_ms, p99_ms}} over the most recent samples of each stage.
+        """
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+            counts = dict(self._counts)
+        return {
+            name: {
+                'count': counts[name],
+                'p50_ms': percentile(values, 50),
+                'p95_ms': percentile(values, 95),
+                'p99_ms': percentile(values, 99),
+            }
+            for name, values in samples.items()
+        }
+
+    def _maybe_export(self):
+        if not self.export_path:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_export < self.export_every_seconds:
+                return
+            self._last_export = now
+        self.export()
+
+    def export(self):
+        """
+        Appends the current snapshot to `export_path` as {"time": ..., "stages": {...}}.
+        """
+        directory = os.path.dirname(self.export_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.export_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'time': time.time(), 'stages': self.snapshot()}) + '\n')
+        except OSError as e:
+            print(f"Could not export latency metrics to {self.export_path}: {e}")
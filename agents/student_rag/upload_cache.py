@@ -0,0 +1,124 @@
+# upload_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+UPLOAD_CACHE_MEMORY_ENTRIES = 32
+UPLOAD_CACHE_MAX_DISK_BYTES = 512 * 1024 * 1024
+
+
+def content_key(data, *config):
+    """
+    Cache key of an uploaded file: the SHA-256 of its bytes plus whatever settings shape the
+    cached result (chunk sizes, embedding model and dimension), so changing them misses the cache.
+    """
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(config, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """
+    Processed uploads keyed by content hash: the chunks of a PDF and their unit-length
+    embedding matrix, as built by PdfChunkIndex.prepare().
+
+    The most recently used `memory_entries` stay in memory. Every entry is also written to
+    `directory` (a JSON file with the chunks and a .npy file with the vectors), which is kept
+    under `max_disk_bytes` by deleting the least recently used files, so entries survive
+    memory eviction and restarts. Thread-safe, so one instance can serve every session.
+    """
+
+    def __init__(self, directory, memory_entries=UPLOAD_CACHE_MEMORY_ENTRIES,
+                 max_disk_bytes=UPLOAD_CACHE_MAX_DISK_BYTES):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (chunks, matrix), least recently used first
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.npy'
+
+    def get(self, key):
+        """
+        Returns (chunks, matrix) or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+        chunks_path, vectors_path = self._paths(key)
+        try:
+            with open(chunks_path, 'r', encoding='utf-8') as f:
+                chunks = json.load(f)
+            matrix = np.load(vectors_path)
+            for path in (chunks_path, vectors_path):
+                os.utime(path)  # Marks the entry as recently used for disk eviction
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring unreadable upload cache entry {key}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, (chunks, matrix))
+        return chunks, matrix
+
+    def put(self, key, chunks, matrix):
+        chunks_path, vectors_path = self._paths(key)
+        try:
+            # Vectors first: an entry only counts once its chunks file exists
+            with open(vectors_path + '.tmp', 'wb') as f:
+                np.save(f, np.asarray(matrix, dtype=np.float32))
+            os.replace(vectors_path + '.tmp', vectors_path)
+            with open(chunks_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(chunks, f)
+            os.replace(chunks_path + '.tmp', chunks_path)
+            self._prune_disk()
+        except OSError as e:
+            print(f"Could not write upload cache entry {key}: {e}")
+        with self._lock:
+            self._remember(key, (chunks, matrix))
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.memory_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(('.json', '.npy')):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._entries),
+            }